@@ -0,0 +1,162 @@
+import metrics
+import lazy
+
+np = lazy.lazy_import('numpy')
+pd = lazy.lazy_import('pandas')
+
+DIRECTIONS = ('nearest', 'backward')
+# yielded by a chunked stream that has no rows yet, see align_chunks
+STALLED = object()
+
+
+def match_rows(base_keys, keys, tolerance=0, direction='nearest'):
+    """
+    Function to find, for every base key, the row of keys that matches it.
+    keys is sorted once here and every base key is looked up with a binary
+    search. direction='backward' only matches rows at or before the base key,
+    'nearest' matches the closest row on either side. Returns the matched row
+    positions in the unsorted keys and a boolean mask of base keys that found
+    a match within tolerance.
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError("direction must be one of %s, not %r" % (DIRECTIONS, direction))
+    base_keys = np.asarray(base_keys)
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    if len(keys) == 0:
+        return np.zeros(len(base_keys), dtype=np.intp), np.zeros(len(base_keys), dtype=bool)
+
+    if tolerance == 0:
+        # exact matches work for any sortable key, including strings
+        position = np.minimum(np.searchsorted(sorted_keys, base_keys, side='left'), len(keys) - 1)
+        matched = sorted_keys[position] == base_keys
+        return order[position], matched
+
+    after = np.searchsorted(sorted_keys, base_keys, side='right')
+    before = np.maximum(after - 1, 0)
+    distance_before = np.where(after > 0, base_keys - sorted_keys[before], np.inf)
+    if direction == 'backward':
+        position, distance = before, distance_before
+    else:
+        after = np.minimum(after, len(keys) - 1)
+        distance_after = np.where(sorted_keys[after] >= base_keys, sorted_keys[after] - base_keys, np.inf)
+        use_after = distance_after < distance_before
+        position = np.where(use_after, after, before)
+        distance = np.where(use_after, distance_after, distance_before)
+    return order[position], distance <= tolerance
+
+def align_streams(streams, on='timestamp', tolerance=0, direction='nearest', suffixes=('_1', '_2')):
+    """
+    Function to join sensor streams on their timestamps in a single pass.
+    The first stream is the base: every other stream is matched against its
+    timestamps and only base rows that match every stream are kept, like a
+    chain of inner merges. Colliding column names are suffixed the same way
+    pd.merge would suffix them. streams is a list of (name, dataframe) pairs.
+    Returns the joined dataframe and a dict of the fraction of base rows each
+    stream matched. Matching each stream is timed as a 'merge {name}' stage
+    and gathering the joined columns as 'merge columns'.
+    """
+    base_name, base = streams[0]
+    base_keys = base[on].to_numpy()
+    keep = np.ones(len(base), dtype=bool)
+    matches = []
+    match_rates = {base_name: 1.0}
+    for name, stream in streams[1:]:
+        with metrics.stage('merge ' + name, len(base_keys)):
+            positions, matched = match_rows(base_keys, stream[on].to_numpy(), tolerance, direction)
+        matches.append((stream, positions))
+        keep &= matched
+        match_rates[name] = float(matched.mean()) if len(matched) else 0.0
+
+    rows = np.flatnonzero(keep)
+    with metrics.stage('merge columns', len(rows)):
+        names = list(base.columns)
+        values = [base[column].to_numpy()[rows] for column in base.columns]
+        for stream, positions in matches:
+            positions = positions[rows]
+            for column in stream.columns:
+                if column == on:
+                    continue
+                if column in names:
+                    names[names.index(column)] = column + suffixes[0]
+                    names.append(column + suffixes[1])
+                else:
+                    names.append(column)
+                values.append(stream[column].to_numpy()[positions])
+        frame = pd.DataFrame(dict(enumerate(values)), index=pd.RangeIndex(len(rows)))
+        frame.columns = names
+    return frame, match_rates
+
+def check_sorted(name, keys, last_key):
+    """
+    Function to raise a ValueError unless keys are in ascending order and
+    continue on from last_key, the final key of the previous chunk.
+    """
+    if len(keys) and (np.any(keys[1:] < keys[:-1]) or (last_key is not None and keys[0] < last_key)):
+        raise ValueError("%s timestamps are not in ascending order, chunked alignment needs sorted logs" % name)
+
+def align_chunks(streams, on='timestamp', tolerance=0, direction='nearest', suffixes=('_1', '_2'), match_rates=None):
+    """
+    Function to join sensor streams that are read in chunks, yielding one
+    joined dataframe per chunk of the base stream. streams is a list of
+    (name, iterator of dataframes) pairs whose timestamps must be in
+    ascending order, as the loggers write them. Only the rows of the other
+    streams that can still match a base timestamp are kept in memory, and the
+    output is the same as align_streams on the whole files. A stream that is
+    still being written may yield STALLED instead of a chunk to stop holding
+    up the base stream: the current base chunk is then matched against the
+    rows it has so far and the rows it misses go unmatched. match_rates, if
+    given, is kept up to date with the fraction of base rows each stream
+    matched so far.
+    """
+    if match_rates is None:
+        match_rates = {}
+    base_name, base_chunks = streams[0]
+    others = [[name, iter(chunks), None, None] for name, chunks in streams[1:]]
+    matched_rows = dict((name, 0) for name, chunks in streams[1:])
+    base_rows = 0
+    last_base_key = None
+    for base_chunk in base_chunks:
+        base_keys = base_chunk[on].to_numpy()
+        check_sorted(base_name, base_keys, last_base_key)
+        if len(base_keys) == 0:
+            continue
+        last_base_key = base_keys[-1]
+        first_key, last_key_needed = (base_keys[0], base_keys[-1]) if tolerance == 0 else (base_keys[0] - tolerance, base_keys[-1] + tolerance)
+        for other in others:
+            name, chunks, buffer, last_key = other
+            while buffer is None or (chunks is not None and (len(buffer) == 0 or buffer[on].iloc[-1] <= last_key_needed)):
+                chunk = next(chunks, None)
+                if chunk is STALLED:
+                    break
+                if chunk is None:
+                    chunks = None
+                    if buffer is None:
+                        buffer = pd.DataFrame(columns=[on])
+                    break
+                keys = chunk[on].to_numpy()
+                check_sorted(name, keys, last_key)
+                if len(keys):
+                    last_key = keys[-1]
+                buffer = chunk if buffer is None else pd.concat([buffer, chunk], ignore_index=True)
+            if buffer is not None:
+                # rows before the first base timestamp minus the tolerance can no longer match
+                buffer = buffer.iloc[np.searchsorted(buffer[on].to_numpy(), first_key, side='left'):].reset_index(drop=True)
+            other[1:] = [chunks, buffer, last_key]
+        frame, chunk_rates = align_streams([(base_name, base_chunk)] + [(name, pd.DataFrame(columns=[on]) if buffer is None else buffer) for name, chunks, buffer, last_key in others], on, tolerance, direction, suffixes)
+        base_rows += len(base_keys)
+        match_rates[base_name] = 1.0
+        for name, rate in list(chunk_rates.items())[1:]:
+            matched_rows[name] += int(round(rate * len(base_keys)))
+            match_rates[name] = matched_rows[name] / base_rows
+        yield frame
+
+def add_alignment_arguments(parser):
+    """
+    Function to add the shared --tolerance and --direction options to an
+    argparse parser.
+    """
+    parser.add_argument('--tolerance', type=float, default=0, help='largest timestamp difference treated as a match when joining sensor streams (default: 0, exact)')
+    parser.add_argument('--direction', choices=DIRECTIONS, default='nearest', help='match the nearest sensor row or the last one at or before each timestamp (default: nearest)')
+    return parser
@@ -0,0 +1,255 @@
+import os
+import sys
+import math
+import json
+import time
+import shutil
+import contextlib
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import dead_reckoning
+import align
+import columnar
+import windows
+import format
+import calculate_drift
+
+STAGES = ('ingest', 'merge', 'geodesy', 'drift_windows', 'dead_reckoning', 'plotting', 'write', 'format')
+METERS_PER_DEGREE = 111320.0
+
+
+def make_session(folder_path, rows=10000, rate=10.0, noise=2.0, heading_noise=1.0, clock_skew=0.0, heading_drift=0.5, speed=8.0, start_lat=38.8, start_lon=-77.07, start_time=1636650000000, seed=0):
+    """
+    Function to write a synthetic session folder with the sensor files and
+    columns format.py and calculate_drift.py read. The vehicle drives a
+    random walk at about speed m/s, logged rate times a second. gps fixes
+    carry noise meters of error, the kvh compass drifts by heading_drift
+    degrees a minute plus heading_noise degrees of noise, the doppler reads
+    the distance short by calculate_drift's doppler_compensation_factor, and
+    every sensor but the coordinates logs clock_skew ms late. The rpi fix is
+    the compass/doppler dead reckoned track.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder_path, exist_ok=True)
+    timestamps = start_time + np.round(np.arange(rows) * 1000.0 / rate).astype(np.int64)
+    skewed = timestamps + int(round(clock_skew))
+    minutes = (timestamps - start_time) / 60000.0
+    speeds = np.clip(speed + np.cumsum(rng.normal(0, 0.05, rows)), 0, 3 * speed)
+    steps = speeds / rate
+    headings = (rng.uniform(0, 360) + np.cumsum(rng.normal(0, 2.0, rows))) % 360
+    true_lat, true_lon = dead_reckoning.integrate(start_lat, start_lon, headings, steps)
+    meters_lon = METERS_PER_DEGREE * np.cos(np.radians(start_lat))
+    gps_lat = true_lat + rng.normal(0, noise, rows) / METERS_PER_DEGREE
+    gps_lon = true_lon + rng.normal(0, noise, rows) / meters_lon
+    kvh_heading = (headings + heading_drift * minutes + rng.normal(0, heading_noise, rows)) % 360
+    distance_1 = steps / calculate_drift.doppler_compensation_factor * (1 + rng.normal(0, 0.01, rows))
+    rpi_lat, rpi_lon = dead_reckoning.integrate(start_lat, start_lon, kvh_heading, distance_1 * calculate_drift.doppler_compensation_factor)
+
+    def write(name, columns):
+        pd.DataFrame(columns).to_csv(os.path.join(folder_path, name), index=False)
+    write('rpi-coordinates.csv', {'timestamp': timestamps, 'rpi_lat': rpi_lat, 'rpi_lon': rpi_lon, 'gps_lat': gps_lat, 'gps_lon': gps_lon,
+                                  'msrs_lat': gps_lat + rng.normal(0, noise / 4, rows) / METERS_PER_DEGREE, 'msrs_lon': gps_lon + rng.normal(0, noise / 4, rows) / meters_lon})
+    write('rpi-kvh-compass.csv', {'timestamp': skewed, 'kvh_heading': kvh_heading})
+    write('rpi-doppler.csv', {'timestamp': skewed, 'distance_1': distance_1, 'speed': speeds})
+    write('rpi-altitude-temperature.csv', {'timestamp': skewed, 'altitude': 100 + np.cumsum(rng.normal(0, 0.05, rows)), 'temperature': 20 + rng.normal(0, 0.2, rows)})
+    write('rpi-secondary-compass.csv', {'timestamp': skewed, 'heading': (headings + rng.normal(0, 2 * heading_noise, rows)) % 360})
+    return folder_path
+
+def make_sessions(open_path, count, rows, seed=0, **options):
+    """
+    Function to write count synthetic session folders under open_path named
+    like the logger's date-time folders, and return their paths.
+    """
+    return [make_session(os.path.join(open_path, '11-10-2021-16-17-%02d' % index), rows, seed=seed + index, **options) for index in range(count)]
+
+def best_time(function, repeat, setup=None):
+    """
+    Function to return the fastest of repeat runs of function, in seconds,
+    and the result of the last run. setup, if given, is called before every
+    run outside the timing and its result is passed to function.
+    """
+    seconds = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        result = function(argument) if setup else function()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+def skew_tolerance(clock_skew):
+    """
+    Function to return the timestamp tolerance in ms that joins the sensor
+    rows of sessions written with clock_skew back onto their coordinates.
+    """
+    return int(math.ceil(abs(clock_skew)))
+
+def time_stages(folder_path, repeat=3, tolerance=0):
+    """
+    Function to time each stage of the pipeline on one session folder, its
+    sensor rows joined within tolerance ms, and return a dict of stage name
+    to the fastest run in seconds.
+    """
+    root, folder = os.path.split(os.path.normpath(folder_path))
+    timings = {}
+    timings['ingest'], streams = best_time(lambda: calculate_drift.read_sensor_files(root, folder), repeat)
+    timings['merge'], (merged, match_rates) = best_time(lambda: align.align_streams(streams, on='timestamp', tolerance=tolerance), repeat)
+    timings['geodesy'], tracked = best_time(lambda frame: (calculate_drift.add_track_columns(frame), frame)[1], repeat, merged.copy)
+    bearing_difference = tracked["gps_minus_rpi_bearing"].to_numpy()
+    timings['drift_windows'], (average_drift_array, average_drift_std) = best_time(lambda: windows.drift_statistics(bearing_difference, calculate_drift.increment_value), repeat)
+    average_distance_between_rpi_and_gps = calculate_drift.exact_mean([tracked["gps_distance_minus_rpi_distance_meters"].to_numpy()])
+    timings['dead_reckoning'], analyzed = best_time(lambda frame: (calculate_drift.add_experimental_columns(frame, average_drift_array, average_drift_std, average_distance_between_rpi_and_gps), frame)[1], repeat, tracked.copy)
+    with tempfile.TemporaryDirectory() as directory:
+        def plot():
+            calculate_drift.plot_coordinates_on_mapbox(analyzed, os.path.join(directory, 'map.html'))
+            calculate_drift.plot_data_in_plotly_bar_chart(analyzed, os.path.join(directory, 'linechart.html'))
+        timings['plotting'], _ = best_time(plot, repeat)
+        timings['write'], _ = best_time(lambda: columnar.write_frame(analyzed, os.path.join(directory, 'analyzed.csv')), repeat)
+        session_copy = os.path.join(directory, folder)
+        shutil.copytree(folder_path, session_copy)
+        timings['format'], _ = best_time(lambda: format.format_folder(directory, folder, directory, tolerance), repeat)
+    return timings
+
+def time_pipeline(open_path, workers, repeat=1, tolerance=0):
+    """
+    Function to time full format and drift runs over every session folder
+    under open_path with the given number of workers and timestamp
+    tolerance, forcing every folder to be processed. Returns a dict of script name to the fastest run in
+    seconds.
+    """
+    def run(function, *args):
+        results = function(*args)
+        failed = [result for result in results if result['status'] == 'failed']
+        if failed:
+            raise RuntimeError("%s failed on %s: %s" % (function.__name__, failed[0]['folder'], failed[0]['error']))
+    format_seconds, _ = best_time(lambda: run(format.iterate_through_files_in_folder, open_path, open_path, workers, True, None, tolerance), repeat)
+    drift_seconds, _ = best_time(lambda: run(calculate_drift.calculate_drift, open_path, open_path, workers, True, None, tolerance), repeat)
+    return {'format': format_seconds, 'calculate_drift': drift_seconds}
+
+def git_commit():
+    """
+    Function to return the commit the benchmark ran on, or None outside a
+    git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(sizes, worker_counts, sessions=4, repeat=3, session_options=None, stream=sys.stderr):
+    """
+    Function to time every stage at each session size and the full pipeline
+    at each worker count, on synthetic sessions in a scratch directory. The
+    sensor rows are joined within the tolerance the sessions' clock skew
+    needs. The pipeline's own progress prints are silenced. Returns the results as a
+    json-ready dict.
+    """
+    session_options = session_options or {}
+    tolerance = skew_tolerance(session_options.get('clock_skew', 0))
+    results = {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+               'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': repeat, 'tolerance': tolerance, 'session_options': session_options, 'stages': [], 'pipeline': []}
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        for rows in sizes:
+            open_path = os.path.join(directory, str(rows))
+            folders = make_sessions(open_path, max(sessions, 1), rows, **session_options)
+            timings = time_stages(folders[0], repeat, tolerance)
+            for stage in STAGES:
+                results['stages'].append({'rows': rows, 'stage': stage, 'seconds': timings[stage], 'rows_per_second': rows / timings[stage] if timings[stage] else None})
+                print("%8d rows  %-15s %9.4fs" % (rows, stage, timings[stage]), file=stream)
+            for workers in worker_counts:
+                timings = time_pipeline(open_path, workers, repeat, tolerance)
+                for script, seconds in timings.items():
+                    results['pipeline'].append({'rows': rows, 'sessions': len(folders), 'workers': workers, 'script': script, 'seconds': seconds})
+                    print("%8d rows  %d sessions  %d workers  %-15s %9.4fs" % (rows, len(folders), workers, script, seconds), file=stream)
+            shutil.rmtree(open_path)
+    return results
+
+def compare_results(old, new, stream=sys.stdout):
+    """
+    Function to print the speed-up of every stage and pipeline run from an
+    old to a new benchmark result, matched by size and worker count.
+    """
+    print("%s -> %s" % (old.get('commit'), new.get('commit')), file=stream)
+    for section, keys in (('stages', ('rows', 'stage')), ('pipeline', ('rows', 'sessions', 'workers', 'script'))):
+        previous = dict((tuple(record[key] for key in keys), record['seconds']) for record in old.get(section, []))
+        for record in new.get(section, []):
+            key = tuple(record[key] for key in keys)
+            if key in previous and record['seconds']:
+                print("%-45s %9.4fs -> %9.4fs  %6.2fx" % ('  '.join(str(part) for part in key), previous[key], record['seconds'], previous[key] / record['seconds']), file=stream)
+
+def parse_counts(text):
+    """
+    Function to parse a comma separated list of positive whole numbers.
+    """
+    try:
+        counts = [int(value) for value in text.split(',') if value.strip()]
+    except ValueError:
+        counts = []
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError("%r is not a comma separated list of positive whole numbers" % text)
+    return counts
+
+def parse_sizes(text):
+    """
+    Function to parse a comma separated list of session lengths, none
+    shorter than the sessions format keeps.
+    """
+    sizes = parse_counts(text)
+    if min(sizes) < format.MIN_ROWS:
+        raise argparse.ArgumentTypeError("sessions shorter than %d rows are deleted by format, %r has one" % (format.MIN_ROWS, text))
+    return sizes
+
+def add_session_arguments(parser):
+    """
+    Function to add the synthetic session options to an argparse parser.
+    """
+    parser.add_argument('--rate', type=float, default=10.0, help='samples a second (default: 10)')
+    parser.add_argument('--noise', type=float, default=2.0, help='gps noise in meters (default: 2)')
+    parser.add_argument('--heading-noise', type=float, default=1.0, help='compass noise in degrees (default: 1)')
+    parser.add_argument('--clock-skew', type=float, default=0.0, help='ms the other sensors log behind the coordinates; run joins them within that many ms, format and drift need a --tolerance at least as large (default: 0)')
+    parser.add_argument('--heading-drift', type=float, default=0.5, help='compass drift in degrees a minute (default: 0.5)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the first session (default: 0)')
+    return parser
+
+def session_options(args):
+    """
+    Function to collect the synthetic session options from parsed arguments.
+    """
+    return {'rate': args.rate, 'noise': args.noise, 'heading_noise': args.heading_noise, 'clock_skew': args.clock_skew, 'heading_drift': args.heading_drift, 'seed': args.seed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic sessions.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = add_session_arguments(commands.add_parser('run', help='time every stage and the full pipeline and save the results as json'))
+    run_parser.add_argument('--sizes', type=parse_sizes, default=[1000, 10000, 100000], help='comma separated session lengths in rows (default: 1000,10000,100000)')
+    run_parser.add_argument('--workers', type=parse_counts, default=[1, 2, 4], help='comma separated worker counts for the full pipeline (default: 1,2,4)')
+    run_parser.add_argument('--sessions', type=int, default=4, help='sessions per size for the full pipeline (default: 4)')
+    run_parser.add_argument('--repeat', type=int, default=3, help='runs per stage and pipeline run, the fastest is kept (default: 3)')
+    run_parser.add_argument('--output', default='benchmark-results.json', help='json file for the results (default: benchmark-results.json)')
+    generate_parser = add_session_arguments(commands.add_parser('generate', help='write synthetic session folders'))
+    generate_parser.add_argument('open_path', help='folder to write the sessions into')
+    generate_parser.add_argument('--rows', type=int, default=10000, help='rows per session (default: 10000)')
+    generate_parser.add_argument('--sessions', type=int, default=1, help='number of sessions (default: 1)')
+    compare_parser = commands.add_parser('compare', help='print the speed-ups between two result files')
+    compare_parser.add_argument('old', help='results of the baseline commit')
+    compare_parser.add_argument('new', help='results of the commit to compare')
+    args = parser.parse_args()
+    if args.command == 'run':
+        results = run_benchmark(args.sizes, args.workers, args.sessions, args.repeat, session_options(args))
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print("results written to %s" % args.output, file=sys.stderr)
+    elif args.command == 'generate':
+        options = session_options(args)
+        for folder_path in make_sessions(args.open_path, args.sessions, args.rows, **options):
+            print(folder_path)
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        compare_results(old, new)
@@ -1,53 +1,42 @@
-import os
-import pandas as pd
 import sys
-from geopy.distance import geodesic
-from geographiclib.geodesic import Geodesic
-from turfpy import measurement
-from geojson import Point, Feature
 import math
-import plotly.express as px
-from dotenv import load_dotenv
+import geodesy
+import windows
+import dead_reckoning
+import runner
+import manifest
+import align
+import columnar
+import schema
+import report
+import metrics
+import pipeline
+import lazy
 
-load_dotenv()
-px.set_mapbox_access_token(os.environ.get("MAPBOX"))
+np = lazy.lazy_import('numpy')
+pd = lazy.lazy_import('pandas')
 
 def import_csv_as_df(csv_file):
   """
-  Function to import a csv file as a pandas dataframe.
+  Function to import a csv file as a pandas dataframe, reading its parquet
+  or feather copy instead when there is one.
   """
-  df = pd.read_csv(csv_file)
+  df = columnar.read_frame(csv_file)
   return df
 
-def plot_data_in_plotly_bar_chart(df, save_path):
+def plot_data_in_plotly_bar_chart(df, save_path, point_budget=report.POINT_BUDGET, plotlyjs='inline'):
   """
-  Function to plot data in a plotly bar chart.
+  Function to plot the bearing and drift columns as lines on one chart,
+  each decimated to point_budget points.
   """
-  print('plotting charts')
+  metrics.say('plotting charts')
   try:
-    chart = px.line(df, x=df.index, y='rpi_bearing', title='rpi_bearing', height=800)
-    chart1 = px.line(df, x=df.index, y='gps_bearing', title='rpi_bearing', height=800)
-    chart2 = px.line(df, x=df.index, y='drift_between_rpi_and_gps_meters', title='rpi_bearing', height=800)
-    chart3 = px.line(df, x=df.index, y='gps_minus_rpi_bearing', title='rpi_bearing', height=800)
-    chart4 = px.line(df, x=df.index, y='experimental_heading', title='rpi_bearing', height=800)
-    chart5 = px.line(df, x=df.index, y='drift_from_experimental_coords_to_gps_coords', title='rpi_bearing', height=800)
-    chart6 = px.line(df, x=df.index, y='rpi_heading', title='rpi_bearing', height=800)
-    chart1['data'][0]['line']['color']='rgb(255, 0, 0)'
-    chart2['data'][0]['line']['color']='rgb(0, 255, 0)'
-    chart3['data'][0]['line']['color']='rgb(0, 0, 255)'
-    chart4['data'][0]['line']['color']='rgb(0, 255, 255)'
-    chart5['data'][0]['line']['color']='rgb(0, 0, 0)'
-    chart6['data'][0]['line']['color']='rgb(50, 100, 200)'
-    chart.add_trace(chart1.data[0])
-    chart.add_trace(chart2.data[0])
-    chart.add_trace(chart3.data[0])
-    chart.add_trace(chart4.data[0])
-    chart.add_trace(chart5.data[0])
-    chart.add_trace(chart6.data[0])
-    chart.update_layout(title_font_color="red", title_x=0.5, title_font_size=18)
-    chart.write_html(save_path)
+    with metrics.stage('plot chart', len(df)):
+      columns = ['rpi_bearing', 'gps_bearing', 'drift_between_rpi_and_gps_meters', 'gps_minus_rpi_bearing', 'experimental_heading', 'drift_from_experimental_coords_to_gps_coords', 'rpi_heading']
+      colors = ['#636efa', 'rgb(255, 0, 0)', 'rgb(0, 255, 0)', 'rgb(0, 0, 255)', 'rgb(0, 255, 255)', 'rgb(0, 0, 0)', 'rgb(50, 100, 200)']
+      report.line_report(df, columns, save_path, title='rpi_bearing', overlay=True, colors=colors, budget=point_budget, plotlyjs=plotlyjs)
   except Exception as e:
-    print(sys.exc_info()[0], save_path, e)
+    metrics.warn("could not chart %s: %s: %s" % (save_path, type(e).__name__, e))
   
 def calculate_new_coordinates(prev_lat, prev_lon, heading, distance):
   R = 6378.1 #Radius of the Earth
@@ -62,30 +51,26 @@ def calculate_new_coordinates(prev_lat, prev_lon, heading, distance):
   return {'lat': lat2, 'lon': lon2} # return new coordinates
       
 
-def plot_coordinates_on_mapbox(df, save_path):
+def plot_coordinates_on_mapbox(df, save_path, point_budget=report.POINT_BUDGET, plotlyjs='inline'):
   """
-  Function to plot coordinates on a mapbox map.
+  Function to plot coordinates on a mapbox map, thinning each track to
+  point_budget points.
   """
   try:
-    fig = px.scatter_mapbox(df, lat='rpi_lat', lon='rpi_lon', zoom=12, color='gps_minus_rpi_bearing', center={'lat': df['rpi_lat'][0], 'lon': df['rpi_lon'][0]}, hover_data=["drift_between_rpi_and_gps_meters", "average_drift", "doppler_compensation_factor", "experimental_heading", "rpi_bearing"])
-    # fig2 = px.scatter_mapbox(df, lat='msrs_lat', lon='msrs_lon', zoom=18, color_discrete_sequence=['blue'], hover_data=["timestamp", "drift_between_rpi_and_gps_meters", "average_drift", "doppler_compensation_factor", "experimental_heading", "rpi_bearing"])
-    fig3 = px.scatter_mapbox(df, lat='gps_lat', lon='gps_lon', zoom=18, color_discrete_sequence=['#39ff14'], color_continuous_scale='Bluered_r', hover_data=["timestamp", "drift_between_rpi_and_gps_meters", "average_drift", "doppler_compensation_factor", "experimental_heading", "rpi_bearing"])
-    # fig4 = px.scatter_mapbox(df, lat='experimental_lat', lon='experimental_lon', zoom=18, color_discrete_sequence=['#39ffff'], color_continuous_scale='Bluered_r', hover_data=["timestamp", "drift_between_rpi_and_gps_meters", "average_drift", "doppler_compensation_factor", "experimental_heading", "rpi_bearing"])
-    # fig5 = px.scatter_mapbox(df, lat='rpi_doppler_compass_lat', lon='rpi_doppler_compass_lon', zoom=18, color_discrete_sequence=['#ffffff'], color_continuous_scale='Bluered_r', hover_data=["timestamp", "drift_between_rpi_and_gps_meters", "average_drift", "doppler_compensation_factor", "experimental_heading", "rpi_bearing"])
-    # fig6 = px.scatter_mapbox(df, lat="annomaly_gps_lat", lon="annomaly_gps_lon", size=abs(df['gps_minus_rpi_bearing']), color_continuous_scale=px.colors.cyclical.IceFire, size_max=15, zoom=10)
-    # fig7 = px.scatter_mapbox(df, lat="annomaly_rpi_lat", lon="annomaly_rpi_lon", size=abs(df['gps_minus_rpi_bearing']), color_continuous_scale=px.colors.cyclical.IceFire, size_max=15, zoom=10)
-    # fig.add_trace(fig2.data[0])
-    fig.add_trace(fig3.data[0])
-    # fig.add_trace(fig4.data[0])
-    # fig.add_trace(fig5.data[0])
-    # fig.add_trace(fig6.data[0])
-    # fig.add_trace(fig7.data[0])
-    fig.update_layout(mapbox_style="dark")
-    fig.write_html(save_path)
+    with metrics.stage('plot map', len(df)):
+      hover_data = ["timestamp", "drift_between_rpi_and_gps_meters", "average_drift", "doppler_compensation_factor", "experimental_heading", "rpi_bearing"]
+      layers = [report.map_layer(df, 'rpi_lat', 'rpi_lon', color_column='gps_minus_rpi_bearing', hover_columns=hover_data, budget=point_budget)]
+      # layers.append(report.map_layer(df, 'msrs_lat', 'msrs_lon', color='blue', hover_columns=hover_data, budget=point_budget))
+      layers.append(report.map_layer(df, 'gps_lat', 'gps_lon', color='#39ff14', hover_columns=hover_data, budget=point_budget))
+      # layers.append(report.map_layer(df, 'experimental_lat', 'experimental_lon', color='#39ffff', hover_columns=hover_data, budget=point_budget))
+      # layers.append(report.map_layer(df, 'rpi_doppler_compass_lat', 'rpi_doppler_compass_lon', color='#ffffff', hover_columns=hover_data, budget=point_budget))
+      report.map_report(layers, save_path, center={'lat': df['rpi_lat'][0], 'lon': df['rpi_lon'][0]}, zoom=12, plotlyjs=plotlyjs)
   except Exception as e:
-    print(sys.exc_info()[0], save_path, e)
+    metrics.warn("could not map %s: %s: %s" % (save_path, type(e).__name__, e))
 
 def get_turf_distance(lat1, lat2, lon1, lon2):
+  from turfpy import measurement
+  from geojson import Point, Feature
   start = Feature(geometry=Point((lon1, lat1)))
   end = Feature(geometry=Point((lon2, lat2)))
   dist = measurement.distance(start,end)
@@ -106,191 +91,324 @@ def calculate_compass_bearing(lat1, lat2, lon1, lon2):
   compass_bearing = (initial_bearing + 360) % 360
   return compass_bearing
 
-def calculate_drift(open_path, save_path):
-  """
-  Function to iterate through all files in a folder and return a list of
-  dataframes.
-  """
-  for root, subdirectories, files in os.walk(open_path):
-    for folder in subdirectories:
-      print(folder)
-      if True: #folder == "11-10-2021-16-17-08":
-        try:
-          coordinates = pd.read_csv(root + '/' + folder + '/' + 'rpi-coordinates.csv')
-          rpi_compass = pd.read_csv(root + '/' + folder + '/' + 'rpi-kvh-compass.csv')
-          rpi_doppler = pd.read_csv(root + '/' + folder + '/' + 'rpi-doppler.csv')
-          increment_value = 10
-          start_row_range = 0
-          end_row_range = increment_value
-          max_end_row_range = len(coordinates)
-          
-          compass_vehicle_alignment_error = 0
-          # compass_vehicle_alignment_error = -2.6
-          doppler_compensation_factor = 1.019
-          
-          drift = []
-          gps_minus_rpi_bearing_difference = []
-          gps_heading = []
-          rpi_heading = []
-          gps_distance_from_prev_coord = []
-          rpi_distance_from_prev_coord = []
-          gps_distance_minus_rpi_distance = []
-          experimental_lat = []
-          experimental_lon = []
-          average_drift_array = []
-          drift_from_experimental_coords_to_gps_coords = []
-          average_distance_array = []
-          doppler_compensation_factor_array = []
-          experimental_heading_array = []
-          rpi_compass_heading_array = []
-          rpi_doppler_array = []
-          rpi_doppler_compass_lat_array = []
-          rpi_doppler_compass_lon_array = []
-          annomaly_gps_lat_array = []
-          annomaly_gps_lon_array = []
-          annomaly_rpi_lat_array = []
-          annomaly_rpi_lon_array = []
-          
-          prev_rpi_lat = coordinates['rpi_lat'].iloc[0]
-          prev_rpi_lon = coordinates['rpi_lon'].iloc[0]
-          prev_gps_lat = coordinates['gps_lat'].iloc[0]
-          prev_gps_lon = coordinates['gps_lon'].iloc[0]
-          prev_rpi_bearing = 0
-          prev_gps_bearing = 0
-          
-          for index, row in rpi_compass.iterrows():
-            rpi_compass_heading_array.append(row['kvh_heading'])
-            
-          coordinates['rpi_heading'] = rpi_compass_heading_array
-          
-          for index, row in rpi_doppler.iterrows():
-            rpi_doppler_array.append(row['distance_1'])
-            
-          coordinates['rpi_doppler_distance'] = rpi_doppler_array
-            
-          for index, row in coordinates.iterrows():
-            gps_bearing = calculate_compass_bearing(prev_gps_lat, row['gps_lat'], prev_gps_lon, row['gps_lon'])
-            rpi_bearing = calculate_compass_bearing(prev_rpi_lat, row['rpi_lat'], prev_rpi_lon, row['rpi_lon'])
-            gps_dist = get_turf_distance(prev_gps_lat, row['gps_lat'], prev_gps_lon, row['gps_lon'])
-            rpi_dist = get_turf_distance(prev_rpi_lat, row['rpi_lat'], prev_rpi_lon, row['rpi_lon'])
-            drift_distance = geodesic((row['rpi_lat'], row['rpi_lon']), (row['gps_lat'], row['gps_lon'])).km * 1000
-            if rpi_bearing < 0:
-              rpi_bearing = rpi_bearing + 360
-            if gps_bearing < 0:
-              gps_bearing = gps_bearing + 360
-            if gps_bearing >= 180 and gps_bearing <= 181 or gps_bearing >= 270 and gps_bearing <= 271:
-              gps_bearing = prev_gps_bearing
-            if rpi_bearing >= 180 and rpi_bearing <= 181 or rpi_bearing >= 270 and rpi_bearing <= 271:
-              rpi_bearing = prev_rpi_bearing
-            if rpi_bearing == 0:
-              rpi_bearing = prev_rpi_bearing
-            if gps_bearing == 0:
-              gps_bearing = prev_gps_bearing
-              
-            drift.append(drift_distance)
-            rpi_heading.append(rpi_bearing)
-            gps_heading.append(gps_bearing)
-            gps_minus_rpi_bearing_difference.append(gps_bearing - rpi_bearing)
-            gps_distance_from_prev_coord.append(gps_dist*1000)
-            rpi_distance_from_prev_coord.append(rpi_dist*1000)
-            gps_distance_minus_rpi_distance.append(gps_dist*1000 - rpi_dist*1000)
-            
-            prev_rpi_bearing = rpi_bearing
-            prev_gps_bearing = gps_bearing
-            prev_gps_lon = row['gps_lon']
-            prev_gps_lat = row['gps_lat']
-            prev_rpi_lon = row['rpi_lon']
-            prev_rpi_lat = row['rpi_lat']
-            
-          coordinates['gps_minus_rpi_bearing'] = gps_minus_rpi_bearing_difference
-          coordinates['drift_between_rpi_and_gps_meters'] = drift
-          coordinates['gps_bearing'] = gps_heading
-          coordinates['rpi_bearing'] = rpi_heading
-          coordinates['gps_distance_from_prev_coord_meters'] = gps_distance_from_prev_coord
-          coordinates['rpi_distance_from_prev_coord_meters'] = rpi_distance_from_prev_coord
-          coordinates['gps_distance_minus_rpi_distance_meters'] = gps_distance_minus_rpi_distance
-          
-          average_distance_between_rpi_and_gps = coordinates["gps_distance_minus_rpi_distance_meters"].mean()
-          
-          new_lat = coordinates['gps_lat'].iloc[0]
-          new_lon = coordinates['gps_lon'].iloc[0]
-          
-          overall_drift = coordinates["gps_minus_rpi_bearing"].mean()
-          # compass_vehicle_alignment_error = overall_drift
-          average_drift = coordinates["gps_minus_rpi_bearing"].iloc[start_row_range:end_row_range].mean()
-          print('average drift', average_drift)
-          rpi_previous_heading = coordinates['rpi_bearing'].iloc[0]
-          
-          for index, row in coordinates.iterrows():
-            
-            if index % increment_value == 0:
-              if max_end_row_range > start_row_range + increment_value:
-                start_row_range += increment_value
-              if max_end_row_range > end_row_range + increment_value:
-                end_row_range += increment_value
-              else:
-                end_row_range = max_end_row_range
-              average_drift = coordinates["gps_minus_rpi_bearing"].iloc[start_row_range:end_row_range].mean()
-              print('average drift', average_drift)
-            if abs(average_drift) < 16:  
-              new_position = calculate_new_coordinates(new_lat, new_lon, average_drift + row['rpi_bearing'] + compass_vehicle_alignment_error, row['rpi_distance_from_prev_coord_meters']) # * doppler_compensation_factor)
-              experimental_heading_array.append(row['rpi_bearing'] + average_drift + compass_vehicle_alignment_error)
-              annomaly_gps_lat_array.append(0)
-              annomaly_gps_lon_array.append(0)
-              annomaly_rpi_lat_array.append(0)
-              annomaly_rpi_lon_array.append(0)
-            else:
-              new_position = calculate_new_coordinates(new_lat, new_lon, rpi_previous_heading + compass_vehicle_alignment_error, row['rpi_distance_from_prev_coord_meters']) # * doppler_compensation_factor)
-              experimental_heading_array.append(row['rpi_bearing'] + compass_vehicle_alignment_error)
-              annomaly_gps_lat_array.append(row['gps_lat'])
-              annomaly_gps_lon_array.append(row['gps_lon'])
-              annomaly_rpi_lat_array.append(row['rpi_lat'])
-              annomaly_rpi_lon_array.append(row['rpi_lon'])
-            rpi_previous_heading = row['rpi_bearing']
-            new_lat = new_position['lat']
-            new_lon = new_position['lon']
-            
-            
-            experimental_lat.append(new_lat)
-            experimental_lon.append(new_lon)
-            average_drift_array.append(average_drift)
-            average_distance_array.append(average_distance_between_rpi_and_gps)
-            doppler_compensation_factor_array.append(doppler_compensation_factor)
-            
-          coordinates['experimental_lat'] = experimental_lat
-          coordinates['experimental_lon'] = experimental_lon
-          coordinates['experimental_heading'] = experimental_heading_array
-          coordinates['average_drift'] = average_drift_array
-          coordinates['doppler_compensation_factor'] = doppler_compensation_factor_array
-          coordinates['average_distance_between_rpi_and_gps'] = average_distance_array
-          
-          new_lat = coordinates['gps_lat'].iloc[0]
-          new_lon = coordinates['gps_lon'].iloc[0]
-          
-          for index, row in coordinates.iterrows():
-            experimental_drift = get_turf_distance(row['experimental_lat'], row['gps_lat'], row['experimental_lon'], row['gps_lon']) * 1000
-            drift_from_experimental_coords_to_gps_coords.append(experimental_drift)
-            compass_doppler_coordinates = calculate_new_coordinates(new_lat, new_lon, row['rpi_heading'], row['rpi_doppler_distance'] * doppler_compensation_factor)
-            new_lat = compass_doppler_coordinates['lat']
-            new_lon = compass_doppler_coordinates['lon']
-            rpi_doppler_compass_lon_array.append(new_lon)
-            rpi_doppler_compass_lat_array.append(new_lat)
-            
-          coordinates['drift_from_experimental_coords_to_gps_coords'] = drift_from_experimental_coords_to_gps_coords
-          coordinates['rpi_doppler_compass_lon'] = rpi_doppler_compass_lon_array
-          coordinates['rpi_doppler_compass_lat'] = rpi_doppler_compass_lat_array
-          coordinates['annomaly_gps_lat'] = annomaly_gps_lat_array
-          coordinates['annomaly_gps_lon'] = annomaly_gps_lon_array
-          coordinates['annomaly_rpi_lat'] = annomaly_rpi_lat_array
-          coordinates['annomaly_rpi_lon'] = annomaly_rpi_lon_array
-          
-          plot_coordinates_on_mapbox(coordinates, root + '/' + folder + '/' + 'rpi-map-' + folder + '.html')
-          plot_data_in_plotly_bar_chart(coordinates, root + '/' + folder + '/' + 'rpi-linechart-' + folder + '.html')
-          coordinates.to_csv(root + '/' + folder + '/' + 'rpi-coordinates-analyzed-' + folder + '.csv', index=False)
-        except Exception as e:
-          print(e, sys.exc_info(), root + '/' + folder + '/')
+SENSOR_FILES = ['rpi-coordinates.csv', 'rpi-kvh-compass.csv', 'rpi-doppler.csv']
+# (stream name, sensor file, read only the schema's columns, column renames)
+SENSOR_STREAMS = [('coordinates', 'rpi-coordinates.csv', False, {}), ('kvh-compass', 'rpi-kvh-compass.csv', True, {'kvh_heading': 'rpi_heading'}), ('doppler', 'rpi-doppler.csv', True, {'distance_1': 'rpi_doppler_distance'})]
+ANALYZED_FILES = ['rpi-coordinates-analyzed-{folder}.csv']
+PLOT_FILES = ['rpi-map-{folder}.html', 'rpi-linechart-{folder}.html']
+CODE_VERSION = manifest.code_version(__file__, geodesy.__file__, dead_reckoning.__file__, windows.__file__, align.__file__, columnar.__file__, schema.__file__, report.__file__)
+
+increment_value = 10
+compass_vehicle_alignment_error = 0
+# compass_vehicle_alignment_error = -2.6
+doppler_compensation_factor = 1.019
+drift_threshold = 16
+
+def exact_mean(value_blocks):
+  """
+  Function to return the mean of the non-NaN values in an iterable of
+  arrays. The values are summed exactly with math.fsum so the result does
+  not depend on how the rows were split into blocks.
+  """
+  count = [0]
+  def values():
+    for block in value_blocks:
+      block = np.asarray(block, dtype=np.float64)
+      block = block[~np.isnan(block)]
+      count[0] += len(block)
+      yield from block.tolist()
+  total = math.fsum(values())
+  return total / count[0] if count[0] else float('nan')
+
+def add_track_columns(coordinates, previous=None):
+  """
+  Function to add the bearing, step distance and rpi/gps drift columns to a
+  block of coordinates. previous holds the last fixes and bearings of the
+  rows before this block, or None for the first block. Returns the previous
+  dict for the next block.
+  """
+  gps_lat = coordinates['gps_lat'].to_numpy()
+  gps_lon = coordinates['gps_lon'].to_numpy()
+  rpi_lat = coordinates['rpi_lat'].to_numpy()
+  rpi_lon = coordinates['rpi_lon'].to_numpy()
+  if previous is None:
+    previous = {'gps_lat': gps_lat[0], 'gps_lon': gps_lon[0], 'rpi_lat': rpi_lat[0], 'rpi_lon': rpi_lon[0], 'gps_bearing': 0, 'rpi_bearing': 0}
+  gps_heading = geodesy.track_bearings(gps_lat, gps_lon, previous['gps_lat'], previous['gps_lon'], previous['gps_bearing'])
+  rpi_heading = geodesy.track_bearings(rpi_lat, rpi_lon, previous['rpi_lat'], previous['rpi_lon'], previous['rpi_bearing'])
+  gps_distance_from_prev_coord = geodesy.track_distances(gps_lat, gps_lon, previous['gps_lat'], previous['gps_lon']) * 1000
+  rpi_distance_from_prev_coord = geodesy.track_distances(rpi_lat, rpi_lon, previous['rpi_lat'], previous['rpi_lon']) * 1000
+  
+  coordinates['gps_minus_rpi_bearing'] = gps_heading - rpi_heading
+  coordinates['drift_between_rpi_and_gps_meters'] = geodesy.geodesic_distances(rpi_lat, rpi_lon, gps_lat, gps_lon)
+  coordinates['gps_bearing'] = gps_heading
+  coordinates['rpi_bearing'] = rpi_heading
+  coordinates['gps_distance_from_prev_coord_meters'] = gps_distance_from_prev_coord
+  coordinates['rpi_distance_from_prev_coord_meters'] = rpi_distance_from_prev_coord
+  coordinates['gps_distance_minus_rpi_distance_meters'] = gps_distance_from_prev_coord - rpi_distance_from_prev_coord
+  return {'gps_lat': gps_lat[-1], 'gps_lon': gps_lon[-1], 'rpi_lat': rpi_lat[-1], 'rpi_lon': rpi_lon[-1], 'gps_bearing': gps_heading[-1], 'rpi_bearing': rpi_heading[-1]}
+
+def experimental_headings(rpi_bearing, average_drift_array, rpi_previous_heading, alignment_error=0, threshold=16):
+  """
+  Function to return the dead reckoning heading of every row, the
+  experimental_heading column and the mask of rows whose drift window is
+  within threshold degrees. Those rows are steered by the rpi bearing plus
+  the drift, the others (anomalies) keep the previous row's rpi bearing.
+  rpi_previous_heading is the rpi bearing of the row before the first one.
+  """
+  previous_heading = geodesy.previous_values(rpi_bearing, rpi_previous_heading)
+  corrected = np.abs(average_drift_array) < threshold
+  headings = np.where(corrected, average_drift_array + rpi_bearing + alignment_error, previous_heading + alignment_error)
+  experimental_heading = np.where(corrected, rpi_bearing + average_drift_array + alignment_error, rpi_bearing + alignment_error)
+  return headings, experimental_heading, corrected
+
+def add_experimental_columns(coordinates, average_drift_array, average_drift_std, average_distance_between_rpi_and_gps, state=None, engine='auto'):
+  """
+  Function to dead reckon the bearing corrected experimental track and the
+  compass/doppler track over a block of rows. average_drift_array and
+  average_drift_std are the circular mean and standard deviation of the
+  bearing difference in each row's drift window. state holds the positions
+  and heading carried over from the rows before this block, or None to
+  start both tracks at the first gps fix. Returns the state for the next
+  block.
+  engine picks the dead_reckoning engine.
+  """
+  gps_lat = coordinates['gps_lat'].to_numpy()
+  gps_lon = coordinates['gps_lon'].to_numpy()
+  rpi_lat = coordinates['rpi_lat'].to_numpy()
+  rpi_lon = coordinates['rpi_lon'].to_numpy()
+  rpi_bearing = coordinates['rpi_bearing'].to_numpy()
+  rpi_distance = coordinates['rpi_distance_from_prev_coord_meters'].to_numpy()
+  if state is None:
+    state = {'new_lat': gps_lat[0], 'new_lon': gps_lon[0], 'rpi_previous_heading': rpi_bearing[0], 'doppler_lat': gps_lat[0], 'doppler_lon': gps_lon[0]}
+  row_count = len(coordinates)
+  
+  headings, experimental_heading_array, corrected = experimental_headings(rpi_bearing, average_drift_array, state['rpi_previous_heading'], compass_vehicle_alignment_error, drift_threshold)
+  anomaly = ~corrected
+  experimental_lat, experimental_lon = dead_reckoning.integrate(state['new_lat'], state['new_lon'], headings, rpi_distance, engine) # * doppler_compensation_factor)
+    
+  coordinates['experimental_lat'] = experimental_lat
+  coordinates['experimental_lon'] = experimental_lon
+  coordinates['experimental_heading'] = experimental_heading_array
+  coordinates['average_drift'] = average_drift_array
+  coordinates['average_drift_std'] = average_drift_std
+  coordinates['doppler_compensation_factor'] = np.full(row_count, doppler_compensation_factor)
+  coordinates['average_distance_between_rpi_and_gps'] = np.full(row_count, average_distance_between_rpi_and_gps)
+  
+  rpi_heading = coordinates['rpi_heading'].to_numpy(dtype=np.float64)
+  rpi_doppler_distance = coordinates['rpi_doppler_distance'].to_numpy(dtype=np.float64)
+  rpi_doppler_compass_lat_array, rpi_doppler_compass_lon_array = dead_reckoning.integrate(state['doppler_lat'], state['doppler_lon'], rpi_heading, rpi_doppler_distance * doppler_compensation_factor, engine)
+    
+  coordinates['drift_from_experimental_coords_to_gps_coords'] = geodesy.haversine_distances(experimental_lat, gps_lat, experimental_lon, gps_lon) * 1000
+  coordinates['rpi_doppler_compass_lon'] = rpi_doppler_compass_lon_array
+  coordinates['rpi_doppler_compass_lat'] = rpi_doppler_compass_lat_array
+  coordinates['annomaly_gps_lat'] = np.where(anomaly, gps_lat, 0.0)
+  coordinates['annomaly_gps_lon'] = np.where(anomaly, gps_lon, 0.0)
+  coordinates['annomaly_rpi_lat'] = np.where(anomaly, rpi_lat, 0.0)
+  coordinates['annomaly_rpi_lon'] = np.where(anomaly, rpi_lon, 0.0)
+  if row_count == 0:
+    return state
+  return {'new_lat': experimental_lat[-1], 'new_lon': experimental_lon[-1], 'rpi_previous_heading': rpi_bearing[-1], 'doppler_lat': rpi_doppler_compass_lat_array[-1], 'doppler_lon': rpi_doppler_compass_lon_array[-1]}
+
+def rename_chunks(chunks, renames):
+  """
+  Function to rename the columns of every chunk of an iterator of chunks.
+  """
+  for chunk in chunks:
+    yield chunk.rename(columns=renames)
+
+def read_sensor_file(csv_path, required_only, renames):
+  """
+  Function to read one sensor csv file with its schema dtypes and rename
+  its columns.
+  """
+  return schema.read_sensor_csv(csv_path, required_only=required_only).rename(columns=renames)
+
+def sensor_reads(root, folder):
+  """
+  Function to list the sensor csv files of a session folder the drift reads,
+  as (stream name, read function, arguments) for pipeline.read_files or
+  prefetching.
+  """
+  return [(name, read_sensor_file, (root + '/' + folder + '/' + sensor_file, required_only, renames)) for name, sensor_file, required_only, renames in SENSOR_STREAMS]
+
+def read_sensor_files(root, folder, chunk_size=None):
+  """
+  Function to read the coordinates, kvh compass and doppler csv files of a
+  session folder with their schema dtypes, keeping only the compass and
+  doppler columns the drift needs. With a chunk_size each file is returned
+  as an iterator of chunks. Reading each file is timed as a 'read {name}'
+  stage.
+  """
+  if not chunk_size:
+    return pipeline.read_files(sensor_reads(root, folder))
+  streams = []
+  for name, sensor_file, required_only, renames in SENSOR_STREAMS:
+    streams.append((name, metrics.timed_chunks('read ' + name, rename_chunks(schema.read_sensor_csv(root + '/' + folder + '/' + sensor_file, required_only=required_only, chunk_size=chunk_size), renames))))
+  return streams
+
+def write_analyzed(coordinates, csv_path, output_formats):
+  """
+  Function to write the analyzed table in output_formats.
+  """
+  with metrics.stage('write', len(coordinates)):
+    columnar.write_frame(coordinates, csv_path, output_formats)
+
+def calculate_drift_for_folder(root, folder, tolerance=0, direction='nearest', output_formats=('csv',), window_mode='block', window_size=increment_value, point_budget=report.POINT_BUDGET, plotlyjs='inline', reads=None, writer=None):
+  """
+  Function to calculate the drift between the rpi and gps tracks of one
+  session folder and write its maps, line chart and analyzed table in
+  output_formats. The kvh heading and doppler distance are joined onto the
+  coordinates by timestamp. The drift is averaged over window_size rows,
+  either the next block or a rolling window (window_mode). Charts and maps
+  keep point_budget points per line or track. reads are the folder's files
+  already being read and writer the background writer to hand the outputs
+  to, when run by pipeline.run_folders.
+  """
+  streams = pipeline.collect(reads) if reads is not None else read_sensor_files(root, folder)
+  coordinates, match_rates = align.align_streams(streams, on='timestamp', tolerance=tolerance, direction=direction)
+  if len(coordinates) == 0:
+    raise ValueError('no aligned rows in ' + root + '/' + folder)
+  with metrics.stage('geodesy', len(coordinates)):
+    add_track_columns(coordinates)
+    average_distance_between_rpi_and_gps = exact_mean([coordinates["gps_distance_minus_rpi_distance_meters"].to_numpy()])
+  with metrics.stage('drift windows', len(coordinates)):
+    average_drift_array, average_drift_std = windows.drift_statistics(coordinates["gps_minus_rpi_bearing"].to_numpy(), window_size, window_mode)
+  with metrics.stage('dead reckoning', len(coordinates)):
+    add_experimental_columns(coordinates, average_drift_array, average_drift_std, average_distance_between_rpi_and_gps)
+  
+  pipeline.write(writer, plot_coordinates_on_mapbox, coordinates, root + '/' + folder + '/' + 'rpi-map-' + folder + '.html', point_budget, plotlyjs)
+  pipeline.write(writer, plot_data_in_plotly_bar_chart, coordinates, root + '/' + folder + '/' + 'rpi-linechart-' + folder + '.html', point_budget, plotlyjs)
+  pipeline.write(writer, write_analyzed, coordinates, root + '/' + folder + '/' + 'rpi-coordinates-analyzed-' + folder + '.csv', output_formats)
+  return {'rows': len(coordinates), 'match_rates': match_rates}
+
+def plot_folder(root, folder, point_budget=report.POINT_BUDGET, plotlyjs='inline'):
+  """
+  Function to redraw the map and line chart of one session folder from its
+  analyzed table without recalculating it, e.g. after a chunked run, which
+  writes no plots. Returns 'skipped' when the folder has no analyzed table.
+  """
+  csv_path = root + '/' + folder + '/' + 'rpi-coordinates-analyzed-' + folder + '.csv'
+  if columnar.find_frame(csv_path) is None:
+    return {'status': 'skipped', 'reason': 'no analyzed table'}
+  coordinates = metrics.timed('read analyzed', import_csv_as_df, csv_path)
+  plot_coordinates_on_mapbox(coordinates, root + '/' + folder + '/' + 'rpi-map-' + folder + '.html', point_budget, plotlyjs)
+  plot_data_in_plotly_bar_chart(coordinates, root + '/' + folder + '/' + 'rpi-linechart-' + folder + '.html', point_budget, plotlyjs)
+  return {'rows': len(coordinates)}
+
+def open_drift_stream(average_distance_between_rpi_and_gps, window_mode='block', window_size=increment_value, total_rows=None):
+  """
+  Function to start the experimental columns of a session that arrives in
+  chunks of tracked rows. total_rows is the session's row count, or None
+  while it is still being recorded. Returns the stream state for
+  push_drift_rows.
+  """
+  return {'average_distance_between_rpi_and_gps': average_distance_between_rpi_and_gps, 'window_mode': window_mode, 'window_size': window_size, 'total_rows': total_rows, 'pending': None, 'prefix': None, 'prefix_start': 0, 'first_row': 0, 'state': None}
+
+def push_drift_rows(stream, chunk):
+  """
+  Function to add a chunk of rows with track columns to a drift stream and
+  return the rows whose drift window has been read, with their experimental
+  columns added, or None if no row is finished yet. The previous fixes, dead
+  reckoned positions and the drift window's prefix sums are carried across
+  chunks. A chunk of None ends the session and returns the remaining rows.
+  """
+  if chunk is not None:
+    stream['pending'] = chunk if stream['pending'] is None else pd.concat([stream['pending'], chunk], ignore_index=True)
+    with metrics.stage('drift windows', len(chunk)):
+      bearing_difference = chunk["gps_minus_rpi_bearing"].to_numpy()
+      stream['prefix'] = windows.prefix_sums(bearing_difference) if stream['prefix'] is None else windows.append_prefix_sums(stream['prefix'], bearing_difference)
+  pending = stream['pending']
+  if pending is None or len(pending) == 0:
+    return None
+  first_row = stream['first_row']
+  available_rows = first_row + len(pending)
+  if chunk is None:
+    stream['total_rows'] = available_rows
+  # until the row count is known no window is clamped to the end of the session
+  total_rows = stream['total_rows'] if stream['total_rows'] is not None else np.iinfo(np.int64).max // 4
+  starts, ends = windows.window_bounds(first_row, len(pending), total_rows, stream['window_size'], stream['window_mode'])
+  # a row can be finished once the window it averages has been read
+  ready_rows = len(pending) if available_rows == total_rows else int(np.searchsorted(ends, available_rows, side='right'))
+  if ready_rows == 0:
+    return None
+  rows = pending.iloc[:ready_rows].reset_index(drop=True)
+  with metrics.stage('drift windows'):
+    average_drift_array, average_drift_std = windows.window_statistics(stream['prefix'], starts[:ready_rows] - stream['prefix_start'], ends[:ready_rows] - stream['prefix_start'])
+  with metrics.stage('dead reckoning', ready_rows):
+    stream['state'] = add_experimental_columns(rows, average_drift_array, average_drift_std, stream['average_distance_between_rpi_and_gps'], stream['state'])
+  stream['pending'] = pending.iloc[ready_rows:].reset_index(drop=True)
+  stream['first_row'] = first_row + ready_rows
+  # no window starts more than window_size rows before its row
+  dropped_rows = max(0, stream['first_row'] - stream['window_size'] - stream['prefix_start'])
+  stream['prefix'] = windows.drop_prefix_rows(stream['prefix'], dropped_rows)
+  stream['prefix_start'] += dropped_rows
+  return rows
+
+def calculate_drift_for_folder_in_chunks(root, folder, tolerance=0, direction='nearest', output_formats=('csv',), chunk_size=100000, window_mode='block', window_size=increment_value):
+  """
+  Function to calculate the drift of one session folder while holding only
+  a few chunks of rows in memory, writing analyzed rows as it goes. A first
+  pass counts the aligned rows and the session-wide mean step distance
+  difference, a second pass feeds the rows through a drift stream. The
+  analyzed table matches calculate_drift_for_folder, but no maps or line
+  charts are written since they need the whole session in memory.
+  """
+  def track_chunks():
+    previous = None
+    for chunk in align.align_chunks(read_sensor_files(root, folder, chunk_size), on='timestamp', tolerance=tolerance, direction=direction, match_rates=match_rates):
+      if len(chunk):
+        with metrics.stage('geodesy', len(chunk)):
+          previous = add_track_columns(chunk, previous)
+        yield chunk
+  
+  match_rates = {}
+  total_rows = [0]
+  def distance_differences():
+    for chunk in track_chunks():
+      total_rows[0] += len(chunk)
+      yield chunk["gps_distance_minus_rpi_distance_meters"].to_numpy()
+  average_distance_between_rpi_and_gps = exact_mean(distance_differences())
+  total_rows = total_rows[0]
+  if total_rows == 0:
+    raise ValueError('no aligned rows in ' + root + '/' + folder)
+  
+  writers = columnar.open_frame_writers(root + '/' + folder + '/' + 'rpi-coordinates-analyzed-' + folder + '.csv', output_formats)
+  stream = open_drift_stream(average_distance_between_rpi_and_gps, window_mode, window_size, total_rows)
+  for chunk in track_chunks():
+    rows = push_drift_rows(stream, chunk)
+    if rows is not None:
+      with metrics.stage('write', len(rows)):
+        columnar.write_frame_chunk(writers, rows)
+  with metrics.stage('write'):
+    columnar.close_frame_writers(writers)
+  return {'rows': total_rows, 'match_rates': match_rates}
+
+def calculate_drift(open_path, save_path, workers=1, force=False, only=None, tolerance=0, direction='nearest', chunk_size=0, output_formats=('csv',), window_mode='block', window_size=increment_value, point_budget=report.POINT_BUDGET, plotlyjs='inline', metrics_options=None, prefetch=pipeline.PREFETCH, pending_writes=pipeline.PENDING_WRITES):
+  """
+  Function to calculate the drift of every session folder under open_path
+  and return the per-folder results. Folders whose sensor files and code are
+  unchanged since their last run are skipped unless force is set. With a
+  chunk_size the sessions are streamed in chunks of that many rows.
+  output_formats lists which of csv, parquet and feather the analyzed table
+  is written in. window_mode and window_size pick the drift window and
+  point_budget and plotlyjs how the charts and maps are written. Whole
+  sessions are run by pipeline.run_folders, reading prefetch folders ahead
+  and writing in the background. metrics_options are the instrumentation
+  options the folders are run with.
+  """
+  # a chunked run writes no plots, so it is recorded apart from whole runs to make the next whole run redraw them
+  version = "%s-%s-%s-%s-%s-%s-%s-%s" % (CODE_VERSION, tolerance, direction, window_mode, window_size, point_budget, plotlyjs, 'chunked' if chunk_size else 'whole')
+  pipeline_manifest = manifest.load_manifest(open_path)
+  output_files = columnar.output_names(ANALYZED_FILES, output_formats) + ([] if chunk_size else PLOT_FILES)
+  folders, skipped, fingerprints = manifest.select_folders(pipeline_manifest, 'drift', runner.list_session_folders(open_path), SENSOR_FILES, output_files, version, force=force, only=only)
+  if chunk_size:
+    results = runner.run_folders(calculate_drift_for_folder_in_chunks, folders, (tolerance, direction, output_formats, chunk_size, window_mode, window_size), workers, metrics_options)
+  else:
+    results = pipeline.run_folders(calculate_drift_for_folder, sensor_reads, folders, (tolerance, direction, output_formats, window_mode, window_size, point_budget, plotlyjs), workers, metrics_options, prefetch, pending_writes)
+  manifest.record_folders(pipeline_manifest, 'drift', results, fingerprints, version)
+  manifest.save_manifest(pipeline_manifest, open_path)
+  return skipped + results
 
 if __name__ == '__main__':
-  open_path = "/home/pi/MSRS-RPI/logs"
-  save_path = "/home/pi/MSRS-RPI/logs"
-  calculate_drift(open_path, save_path)
\ No newline at end of file
+  import sanddance
+  sys.exit(sanddance.main(['drift'] + sys.argv[1:]))
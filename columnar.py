@@ -0,0 +1,206 @@
+import os
+import sys
+import time
+import argparse
+import lazy
+
+pd = lazy.lazy_import('pandas')
+
+FORMATS = ('csv', 'parquet', 'feather')
+COLUMNAR_FORMATS = ('parquet', 'feather')
+
+
+def format_path(csv_path, file_format):
+    """
+    Function to return the path of the file_format copy of a csv file.
+    """
+    return csv_path[:-len('.csv')] + '.' + file_format if csv_path.endswith('.csv') else csv_path + '.' + file_format
+
+def output_names(csv_names, formats):
+    """
+    Function to return the names written for csv_names in the given formats,
+    e.g. for the manifest's list of expected outputs.
+    """
+    return [name if file_format == 'csv' else format_path(name, file_format) for name in csv_names for file_format in formats]
+
+def columnar_dtypes(df):
+    """
+    Function to return the explicit dtypes a dataframe is stored with in a
+    columnar file: timestamps as int64 when they are whole numbers, latitude
+    and longitude columns as float64, and every other number as int64 or
+    float64 so no column depends on what pandas inferred from text.
+    """
+    dtypes = {}
+    for column in df.columns:
+        kind = df[column].dtype.kind
+        if column == 'timestamp' and kind in 'iuf':
+            values = df[column].to_numpy()
+            whole = kind in 'iu' or (len(values) and (values == values.round()).all())
+            dtypes[column] = 'int64' if whole else 'float64'
+        elif column.endswith('_lat') or column.endswith('_lon'):
+            dtypes[column] = 'float64'
+        elif kind in 'iu':
+            dtypes[column] = 'int64'
+        elif kind == 'f':
+            dtypes[column] = 'float64'
+    return dtypes
+
+def require_pyarrow(file_format):
+    """
+    Function to import pyarrow, raising an ImportError that names the format
+    that needed it when it is not installed.
+    """
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise ImportError("writing %s files needs pyarrow, install it with 'pip install pyarrow'" % file_format)
+
+def remove_stale_copies(csv_path, formats):
+    """
+    Function to delete the copies of csv_path in every format that is not
+    about to be written, so a reader never picks up an older columnar file.
+    """
+    for file_format in FORMATS:
+        if file_format not in formats:
+            path = csv_path if file_format == 'csv' else format_path(csv_path, file_format)
+            if os.path.exists(path):
+                os.remove(path)
+
+def write_frame(df, csv_path, formats=('csv',), **csv_options):
+    """
+    Function to save a dataframe as csv_path and/or as parquet or feather
+    files next to it. csv_options are passed on to to_csv.
+    """
+    remove_stale_copies(csv_path, formats)
+    for file_format in formats:
+        if file_format == 'csv':
+            df.to_csv(csv_path, index=False, **csv_options)
+        else:
+            require_pyarrow(file_format)
+            typed = df.astype(columnar_dtypes(df)).reset_index(drop=True)
+            if file_format == 'parquet':
+                typed.to_parquet(format_path(csv_path, file_format), index=False)
+            else:
+                typed.to_feather(format_path(csv_path, file_format))
+
+def find_frame(csv_path):
+    """
+    Function to return the path read_frame would read for csv_path, or None
+    if there is no copy of it in any format.
+    """
+    for file_format in COLUMNAR_FORMATS:
+        path = format_path(csv_path, file_format)
+        if os.path.exists(path):
+            return path
+    return csv_path if os.path.exists(csv_path) else None
+
+def read_frame(csv_path):
+    """
+    Function to read the parquet or feather copy of csv_path if one exists,
+    falling back to the csv file itself.
+    """
+    for file_format in COLUMNAR_FORMATS:
+        path = format_path(csv_path, file_format)
+        if os.path.exists(path):
+            return pd.read_parquet(path) if file_format == 'parquet' else pd.read_feather(path)
+    return pd.read_csv(csv_path)
+
+def open_frame_writers(csv_path, formats=('csv',), **csv_options):
+    """
+    Function to start writing a dataframe to csv_path and its columnar copies
+    one chunk at a time. Returns the writer state to pass to write_frame_chunk
+    and close_frame_writers. The first chunk fixes the column types.
+    """
+    remove_stale_copies(csv_path, formats)
+    for file_format in formats:
+        if file_format != 'csv':
+            require_pyarrow(file_format)
+    return {'csv_path': csv_path, 'formats': formats, 'csv_options': csv_options, 'header': True, 'schema': None, 'writers': {}}
+
+def write_frame_chunk(writers, df):
+    """
+    Function to append one chunk of rows to every file opened by
+    open_frame_writers.
+    """
+    if 'csv' in writers['formats']:
+        df.to_csv(writers['csv_path'], mode='w' if writers['header'] else 'a', header=writers['header'], index=False, **writers['csv_options'])
+    writers['header'] = False
+    columnar = [file_format for file_format in writers['formats'] if file_format != 'csv']
+    if not columnar:
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if writers['schema'] is None:
+        table = pa.Table.from_pandas(df.astype(columnar_dtypes(df)), preserve_index=False)
+        writers['schema'] = table.schema
+    else:
+        # safe casting raises instead of silently truncating a later chunk
+        table = pa.Table.from_pandas(df, schema=writers['schema'], preserve_index=False, safe=True)
+    for file_format in columnar:
+        if file_format not in writers['writers']:
+            path = format_path(writers['csv_path'], file_format)
+            writers['writers'][file_format] = pq.ParquetWriter(path, writers['schema']) if file_format == 'parquet' else pa.ipc.new_file(path, writers['schema'])
+        writers['writers'][file_format].write_table(table)
+
+def close_frame_writers(writers):
+    """
+    Function to finish every file opened by open_frame_writers.
+    """
+    for writer in writers['writers'].values():
+        writer.close()
+    writers['writers'] = {}
+
+def parse_formats(text):
+    """
+    Function to parse a comma separated --output-format value.
+    """
+    formats = tuple(file_format.strip() for file_format in text.split(',') if file_format.strip())
+    for file_format in formats:
+        if file_format not in FORMATS:
+            raise argparse.ArgumentTypeError("unknown output format %r, choose from %s" % (file_format, ', '.join(FORMATS)))
+    if not formats:
+        raise argparse.ArgumentTypeError("at least one output format is needed")
+    return formats
+
+def add_output_format_argument(parser):
+    """
+    Function to add the shared --output-format option to an argparse parser.
+    """
+    parser.add_argument('--output-format', type=parse_formats, default=('csv',), help='comma separated formats to write the output tables in: csv, parquet, feather (default: csv). Columnar copies are read in preference to csv')
+    return parser
+
+def benchmark_formats(csv_path, repeat=3, stream=sys.stdout):
+    """
+    Function to time writing and reading the table in csv_path as csv,
+    parquet and feather in a scratch directory next to it, print the timings
+    and the read speed-up over csv, and return them as a dict.
+    """
+    import tempfile
+    df = pd.read_csv(csv_path)
+    timings = {}
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(csv_path))) as directory:
+        scratch_path = os.path.join(directory, 'benchmark.csv')
+        for file_format in FORMATS:
+            path = scratch_path if file_format == 'csv' else format_path(scratch_path, file_format)
+            write_seconds = []
+            read_seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                write_frame(df, scratch_path, (file_format,))
+                write_seconds.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                read_frame(scratch_path)
+                read_seconds.append(time.perf_counter() - start)
+            timings[file_format] = {'write_seconds': min(write_seconds), 'read_seconds': min(read_seconds), 'bytes': os.path.getsize(path)}
+    for file_format, timing in timings.items():
+        print("%-8s write %8.4fs  read %8.4fs  %10d bytes  read speed-up %5.1fx" % (file_format, timing['write_seconds'], timing['read_seconds'], timing['bytes'], timings['csv']['read_seconds'] / timing['read_seconds']), file=stream)
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark csv against parquet and feather for an output table.')
+    parser.add_argument('csv_path', help='a master-*.csv or rpi-coordinates-analyzed-*.csv file')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per format, the fastest is reported (default: 3)')
+    args = parser.parse_args()
+    benchmark_formats(args.csv_path, args.repeat)
@@ -0,0 +1,109 @@
+import math
+import lazy
+
+np = lazy.lazy_import('numpy')
+
+R = 6378.1 # Radius of the Earth in km, as in calculate_new_coordinates
+ENGINES = ('auto', 'numba', 'python')
+
+_compiled_integrate = None
+
+
+def prepare_steps(headings, distances):
+    """
+    Function to precompute the trig terms of every dead-reckoning step from
+    its heading in degrees and distance in meters. The result only depends on
+    the headings and distances, so it can be reused for any start fix.
+    """
+    brng = np.asarray(headings, dtype=np.float64) * (math.pi / 180) # Heading is converted to radians.
+    d = np.asarray(distances, dtype=np.float64) / 1000 # meters to distance in km
+    return {'sin_brng': np.sin(brng), 'cos_brng': np.cos(brng), 'sin_d': np.sin(d / R), 'cos_d': np.cos(d / R)}
+
+def _integrate_python(start_lat, start_lon, sin_brng, cos_brng, sin_d, cos_d, out_lat, out_lon):
+    """
+    Function to run the dead-reckoning recurrence as a tight loop over the
+    precomputed step terms, writing the positions in degrees into out_lat and
+    out_lon. The loop runs over python lists of the step terms and positions,
+    which is faster than indexing the arrays but allocates them per call.
+    """
+    asin, atan2, sin, cos, degrees = math.asin, math.atan2, math.sin, math.cos, math.degrees
+    to_radians = math.pi / 180
+    lat = start_lat
+    lon = start_lon
+    lats = []
+    lons = []
+    for sb, cb, sd, cd in zip(sin_brng.tolist(), cos_brng.tolist(), sin_d.tolist(), cos_d.tolist()):
+        lat1 = lat * to_radians
+        sin_lat1 = sin(lat1)
+        cos_lat1 = cos(lat1)
+        lat2 = asin(sin_lat1 * cd + cos_lat1 * sd * cb)
+        lon2 = lon * to_radians + atan2(sb * sd * cos_lat1, cd - sin_lat1 * sin(lat2))
+        lat = degrees(lat2)
+        lon = degrees(lon2)
+        lats.append(lat)
+        lons.append(lon)
+    out_lat[:] = lats
+    out_lon[:] = lons
+
+def _compile():
+    """
+    Function to compile the dead-reckoning recurrence with numba, returning
+    None when numba is not installed.
+    """
+    global _compiled_integrate
+    if _compiled_integrate is None:
+        try:
+            import numba
+        except ImportError:
+            return None
+
+        @numba.njit(cache=True, nogil=True)
+        def integrate_compiled(start_lat, start_lon, sin_brng, cos_brng, sin_d, cos_d, out_lat, out_lon):
+            to_radians = math.pi / 180
+            to_degrees = 180 / math.pi
+            lat = start_lat
+            lon = start_lon
+            for i in range(sin_brng.shape[0]):
+                lat1 = lat * to_radians
+                sin_lat1 = math.sin(lat1)
+                cos_lat1 = math.cos(lat1)
+                lat2 = math.asin(sin_lat1 * cos_d[i] + cos_lat1 * sin_d[i] * cos_brng[i])
+                lon2 = lon * to_radians + math.atan2(sin_brng[i] * sin_d[i] * cos_lat1, cos_d[i] - sin_lat1 * math.sin(lat2))
+                lat = lat2 * to_degrees
+                lon = lon2 * to_degrees
+                out_lat[i] = lat
+                out_lon[i] = lon
+
+        _compiled_integrate = integrate_compiled
+    return _compiled_integrate
+
+def integrate_steps(start_lat, start_lon, steps, out_lat=None, out_lon=None, engine='auto'):
+    """
+    Function to integrate precomputed steps from a start fix and return the
+    lat/lon after every step. Passing out_lat and out_lon reuses those arrays,
+    so with the numba engine repeated replays of a session allocate nothing;
+    the python loop still builds lists as long as the session. engine is
+    'numba' to run the compiled recurrence, 'python' for the plain loop, or
+    'auto' to use numba when it is installed.
+    """
+    if engine not in ENGINES:
+        raise ValueError("engine must be one of %s, not %r" % (ENGINES, engine))
+    count = len(steps['sin_brng'])
+    if out_lat is None:
+        out_lat = np.empty(count)
+    if out_lon is None:
+        out_lon = np.empty(count)
+    compiled = _compile() if engine != 'python' else None
+    if engine == 'numba' and compiled is None:
+        raise ImportError("the numba dead-reckoning engine needs numba, install it with 'pip install numba'")
+    integrate = compiled or _integrate_python
+    integrate(float(start_lat), float(start_lon), steps['sin_brng'], steps['cos_brng'], steps['sin_d'], steps['cos_d'], out_lat, out_lon)
+    return out_lat, out_lon
+
+def integrate(start_lat, start_lon, headings, distances, engine='auto'):
+    """
+    Function to dead reckon a track from a start fix through arrays of
+    headings in degrees and distances in meters, returning the lat and lon
+    arrays of the position after every step.
+    """
+    return integrate_steps(start_lat, start_lon, prepare_steps(headings, distances), engine=engine)
@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+import json
+import lazy
+import align
+import columnar
+import schema
+import calculate_drift
+
+np = lazy.lazy_import('numpy')
+
+
+def newest_session_folder(open_path):
+    """
+    Function to return the path of the session folder directly under
+    open_path whose coordinates log was written to last, or None if there is
+    none. Only the top level is scanned so it is cheap to call while
+    following.
+    """
+    newest, newest_time = None, None
+    for entry in os.scandir(open_path):
+        if not entry.is_dir():
+            continue
+        try:
+            modified = os.stat(os.path.join(entry.path, 'rpi-coordinates.csv')).st_mtime_ns
+        except OSError:
+            continue
+        if newest_time is None or modified > newest_time:
+            newest, newest_time = entry.path, modified
+    return newest
+
+def open_tail(csv_path, required_only=False, renames=None):
+    """
+    Function to start following a sensor log from its first byte. Returns
+    the tail state for read_appended_rows.
+    """
+    return {'path': csv_path, 'offset': 0, 'header_line': None, 'required_only': required_only, 'renames': renames or {}, 'last_growth': time.monotonic()}
+
+def read_appended_rows(tail):
+    """
+    Function to parse the complete lines written to a followed sensor log
+    since the last call. Only the bytes after the offset reached last time
+    are read, and a line the logger is still writing is left for the next
+    call. Returns None when there is no new complete line.
+    """
+    try:
+        size = os.path.getsize(tail['path'])
+    except OSError:
+        return None
+    if size < tail['offset']:
+        raise ValueError("%s shrank while it was being followed" % tail['path'])
+    if size == tail['offset']:
+        return None
+    with open(tail['path'], 'rb') as f:
+        f.seek(tail['offset'])
+        data = f.read(size - tail['offset'])
+    end = data.rfind(b'\n') + 1
+    if end == 0:
+        return None
+    tail['offset'] += end
+    data = data[:end]
+    if tail['header_line'] is None:
+        header_end = data.index(b'\n') + 1
+        tail['header_line'], data = data[:header_end], data[header_end:]
+        if not data:
+            return None
+    rows = schema.read_sensor_rows(tail['path'], tail['header_line'], data, tail['required_only'])
+    return rows.rename(columns=tail['renames']) if tail['renames'] else rows
+
+def tail_sizes(tails):
+    """
+    Function to return the current size of every followed log.
+    """
+    sizes = []
+    for name, tail in tails:
+        try:
+            sizes.append(os.path.getsize(tail['path']))
+        except OSError:
+            sizes.append(None)
+    return sizes
+
+def summarize(live):
+    """
+    Function to return the summary of a followed session as a dict.
+    """
+    seconds = time.monotonic() - live['started']
+    return {
+        'folder': live['folder'],
+        'status': live['status'],
+        'rows': live['rows'],
+        'rows_per_second': live['rows'] / seconds if seconds > 0 else 0.0,
+        'last_timestamp': live['last_timestamp'],
+        'match_rates': dict(live['match_rates']),
+        'average_drift': live['average_drift'],
+        'drift_from_experimental_coords_to_gps_coords': live['last_drift'],
+        'mean_drift_from_experimental_coords_to_gps_coords': live['drift_sum'] / live['rows'] if live['rows'] else None,
+        'annomaly_rows': live['anomaly_rows'],
+        'updated': time.time(),
+    }
+
+def write_summary(live, summary_path, stream=sys.stdout):
+    """
+    Function to print a one line summary of a followed session and replace
+    its summary json file with the latest figures.
+    """
+    summary = summarize(live)
+    drift = summary['drift_from_experimental_coords_to_gps_coords']
+    print("%-9s %s  %d rows  %.1f rows/s  drift %s m  anomalies %d" % (summary['status'], summary['folder'], summary['rows'], summary['rows_per_second'], "%.2f" % drift if drift is not None else '-', summary['annomaly_rows']), file=stream)
+    temporary_path = summary_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(summary, f, indent=1, sort_keys=True, default=float)
+    os.replace(temporary_path, summary_path)
+
+def follow_session(folder_path, open_path=None, interval=1.0, summary_interval=10.0, idle_timeout=60.0, tolerance=0, direction='nearest', window_mode='block', window_size=calculate_drift.increment_value, output_formats=('csv',), stream=sys.stdout):
+    """
+    Function to analyze a session folder while its sensor logs are still
+    being written. Every interval seconds the lines appended to the
+    coordinates, kvh compass and doppler logs are parsed, aligned and pushed
+    through the same track and drift state as a chunked calculate_drift run,
+    and the finished rows are appended to the analyzed table. A summary is
+    printed and written to rpi-live-summary-{folder}.json every
+    summary_interval seconds. A compass or doppler log that has not grown
+    for idle_timeout seconds while the coordinates keep coming no longer
+    holds them up: the rows it misses are left out of the analyzed table
+    and counted as unmatched in its match rate. Following stops once no log has grown for
+    idle_timeout seconds, once a newer session folder appears under
+    open_path (if given), or on Ctrl-C; the rows still waiting for their
+    drift window are then finished. average_distance_between_rpi_and_gps is
+    the running mean when each row is written, not the session-wide mean.
+    Returns a runner style result dict.
+    """
+    root, folder = os.path.split(os.path.normpath(folder_path))
+    tails = [(name, open_tail(os.path.join(folder_path, sensor_file), required_only, renames)) for name, sensor_file, required_only, renames in calculate_drift.SENSOR_STREAMS]
+    summary_path = os.path.join(folder_path, 'rpi-live-summary-' + folder + '.json')
+    start = time.monotonic()
+    live = {'folder': folder, 'status': 'following', 'stopping': False, 'stopped_by': None, 'started': start, 'rows': 0, 'last_timestamp': None,
+            'match_rates': {}, 'average_drift': None, 'last_drift': None, 'drift_sum': 0.0, 'anomaly_rows': 0,
+            'sizes': tail_sizes(tails), 'last_growth': start, 'next_summary': start + summary_interval}
+
+    def wait():
+        # sleep until the next poll, returning False once following should stop
+        now = time.monotonic()
+        sizes = tail_sizes(tails)
+        if sizes != live['sizes']:
+            live['sizes'], live['last_growth'] = sizes, now
+        if now >= live['next_summary']:
+            write_summary(live, summary_path, stream)
+            live['next_summary'] = now + summary_interval
+            newest = newest_session_folder(open_path) if open_path else None
+            if newest is not None and os.path.normpath(newest) != os.path.normpath(folder_path):
+                live['stopped_by'] = 'new session'
+                return False
+        if now - live['last_growth'] > idle_timeout:
+            live['stopped_by'] = 'idle'
+            return False
+        time.sleep(interval)
+        return True
+
+    def tail_chunks(tail, base):
+        while True:
+            rows = read_appended_rows(tail)
+            if rows is not None and len(rows):
+                tail['last_growth'] = time.monotonic()
+                yield rows
+            elif not base and not live['stopping'] and time.monotonic() - tail['last_growth'] > idle_timeout:
+                # a logger that stopped mid-drive must not stall the others
+                yield align.STALLED
+            elif live['stopping'] or not wait():
+                # let every log drain what it has before the alignment ends
+                live['stopping'] = True
+                return
+
+    def write(rows):
+        if rows is None:
+            return
+        columnar.write_frame_chunk(writers, rows)
+        drift = rows['drift_from_experimental_coords_to_gps_coords'].to_numpy()
+        live['rows'] += len(rows)
+        live['last_timestamp'] = rows['timestamp'].iloc[-1]
+        live['average_drift'] = float(rows['average_drift'].iloc[-1])
+        live['last_drift'] = float(drift[-1])
+        live['drift_sum'] += float(np.nansum(drift))
+        live['anomaly_rows'] += int((rows['annomaly_gps_lat'] != 0).sum())
+
+    writers = columnar.open_frame_writers(os.path.join(folder_path, 'rpi-coordinates-analyzed-' + folder + '.csv'), output_formats)
+    drift_stream = calculate_drift.open_drift_stream(float('nan'), window_mode, window_size)
+    previous = None
+    distance_sum, distance_count = 0.0, 0
+    error = None
+    try:
+        for chunk in align.align_chunks([(name, tail_chunks(tail, index == 0)) for index, (name, tail) in enumerate(tails)], on='timestamp', tolerance=tolerance, direction=direction, match_rates=live['match_rates']):
+            if len(chunk) == 0:
+                continue
+            previous = calculate_drift.add_track_columns(chunk, previous)
+            differences = chunk["gps_distance_minus_rpi_distance_meters"].to_numpy()
+            distance_sum += float(np.nansum(differences))
+            distance_count += int(np.count_nonzero(~np.isnan(differences)))
+            drift_stream['average_distance_between_rpi_and_gps'] = distance_sum / distance_count if distance_count else float('nan')
+            write(calculate_drift.push_drift_rows(drift_stream, chunk))
+    except KeyboardInterrupt:
+        live['stopped_by'] = 'interrupted'
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    write(calculate_drift.push_drift_rows(drift_stream, None))
+    columnar.close_frame_writers(writers)
+    live['status'] = 'failed' if error else 'finished'
+    write_summary(live, summary_path, stream)
+    return {'root': root, 'folder': folder, 'status': 'failed' if error else 'ok', 'seconds': time.monotonic() - start, 'error': error, 'details': {'rows': live['rows'], 'stopped_by': live['stopped_by'], 'match_rates': live['match_rates']}}
+
+def add_follow_arguments(parser):
+    """
+    Function to add the follow mode options to an argparse parser.
+    """
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls of the sensor logs (default: 1)')
+    parser.add_argument('--summary-interval', type=float, default=10.0, help='seconds between summary refreshes (default: 10)')
+    parser.add_argument('--idle-timeout', type=float, default=60.0, help='stop once no sensor log has grown for this many seconds (default: 60)')
+    parser.add_argument('--keep-following', action='store_true', help='after a session ends, wait for the next one and follow it')
+    return parser
+
+
+if __name__ == '__main__':
+    import sanddance
+    sys.exit(sanddance.main(['follow'] + sys.argv[1:]))
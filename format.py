@@ -1,13 +1,17 @@
-import pandas as pd
 import os
-import plotly.express as px
 import math
-import shutil
 import sys
-from dotenv import load_dotenv
+import runner
+import manifest
+import align
+import columnar
+import schema
+import report
+import metrics
+import pipeline
+import lazy
 
-load_dotenv()
-px.set_mapbox_access_token(os.environ.get("MAPBOX"))
+pd = lazy.lazy_import('pandas')
 
 def fill_in_blank_values_in_df(df):
     """
@@ -29,43 +33,37 @@ def delete_file(file_path):
     """
     os.remove(file_path)
 
-def plot_data_in_plotly_bar_chart(df, save_path):
+def plot_data_in_plotly_bar_chart(df, save_path, point_budget=report.POINT_BUDGET, plotlyjs='inline'):
     """
-    Function to plot data in a plotly bar chart.
+    Function to plot every numeric column of a dataframe against dt_inc as
+    stacked line charts in one html file, each decimated to point_budget
+    points.
+    """
+    columns = [column for column in df.columns if column != 'dt_inc' and df[column].dtype.kind in 'iuf']
+    with metrics.stage('plot chart', len(df)):
+        report.line_report(df, columns, save_path.replace('.csv', '.html'), x='dt_inc', budget=point_budget, plotlyjs=plotlyjs)
+
+def plot_coordinates_on_mapbox(df, save_path, point_budget=report.POINT_BUDGET, plotlyjs='inline'):
+    """
+    Function to plot coordinates on a mapbox map, thinning each track to
+    point_budget points.
     """
     try:
-        delete_file(save_path.replace('.csv', '.html'))
-    except:
-        pass
-    for i in range(len(df.columns)):
-        i = px.area(df, x='dt_inc', y=df.columns[i], title=df.columns[i], height=400)
-        i.update_layout(title_font_color="red", title_x=0.5, title_font_size=18)
-        write_to_file(save_path.replace('.csv', '.html'), i.to_html(full_html=False))
-
-def plot_coordinates_on_mapbox(df, save_path, folder_path):
-    """
-    Function to plot coordinates on a mapbox map.
-    """
-    if not df.empty:
-        try:
-            fig = px.scatter_mapbox(df, lat='rpi_lat', lon='rpi_lon', zoom=18, color='altitude', center={'lat': df['rpi_lat'][0], 'lon': df['rpi_lon'][0]}, hover_data=["timestamp"])
-            fig2 = px.scatter_mapbox(df, lat='msrs_lat', lon='msrs_lon', zoom=18, color_discrete_sequence=['blue'], hover_data=["timestamp"])
-            fig3 = px.scatter_mapbox(df, lat='gps_lat', lon='gps_lon', zoom=18, color_discrete_sequence=['#39ff14'], color_continuous_scale='Bluered_r', hover_data=["timestamp"])
-            # fig.add_trace(fig2.data[0])
-            fig.add_trace(fig3.data[0])
-            fig.update_layout(mapbox_style="dark")
-            fig.write_html(save_path.replace('.csv', '.html'))
-        except:
-            print(sys.exc_info()[0], save_path)
-    else:
-        shutil.rmtree(folder_path)
+        with metrics.stage('plot map', len(df)):
+            layers = [report.map_layer(df, 'rpi_lat', 'rpi_lon', color_column='altitude', hover_columns=["timestamp"], budget=point_budget)]
+            # layers.append(report.map_layer(df, 'msrs_lat', 'msrs_lon', color='blue', hover_columns=["timestamp"], budget=point_budget))
+            layers.append(report.map_layer(df, 'gps_lat', 'gps_lon', color='#39ff14', hover_columns=["timestamp"], budget=point_budget))
+            report.map_report(layers, save_path.replace('.csv', '.html'), center={'lat': df['rpi_lat'][0], 'lon': df['rpi_lon'][0]}, zoom=18, plotlyjs=plotlyjs)
+    except Exception as e:
+        metrics.warn("could not map %s: %s: %s" % (save_path, type(e).__name__, e))
 
 
 def import_csv_as_df(csv_file):
     """
-    Function to import a csv file as a pandas dataframe.
+    Function to import a csv file as a pandas dataframe, reading its parquet
+    or feather copy instead when there is one.
     """
-    df = pd.read_csv(csv_file)
+    df = columnar.read_frame(csv_file)
     return df
 
 def save_csv(df, save_path):
@@ -91,55 +89,95 @@ def calculate_distance_between_two_coordinates(lat1, lon1, lat2, lon2):
     return distance
     
 
-def iterate_through_files_in_folder(open_path, save_path):
-    """
-    Function to iterate through all files in a folder and return a list of
-    dataframes.
-    """
-    for root, subdirectories, files in os.walk(open_path):
-        for folder in subdirectories:
-            print(folder)
-            try:
-                data1 = pd.read_csv(root + '/' + folder + '/' + 'rpi-coordinates.csv')
-                if len(data1.index) < 1000:
-                    try:
-                        print('Deleting folder: ' + folder)
-                        shutil.rmtree(root + '/' + folder)
-                    except OSError as e:
-                        print("Error: %s : %s" % (root + '/' + folder, e.strerror))
-                data2 = pd.read_csv(root + '/' + folder + '/' + 'rpi-kvh-compass.csv')
-                output1 = pd.merge(data1, data2, on='timestamp', how='inner', suffixes=['_1','_2'])
-                
-                # data3 = pd.read_csv(root + '/' + folder + '/' + 'rpi-imu.csv')
-                data4 = pd.read_csv(root + '/' + folder + '/' + 'rpi-doppler.csv')
-                # output2 = pd.merge(data3, data4, on='timestamp', how='inner', suffixes=['_1','_2'])
-                output3 = pd.merge(output1, data4, on='timestamp', how='inner', suffixes=['_1','_2'])
-                
-                # data5 = pd.read_csv(root + '/' + folder + '/' + 'biodigital-imu.csv')
-                # data6 = pd.read_csv(root + '/' + folder + '/' + 'biodigital-dmc.csv')
-                # output4 = pd.merge(data5, data6, on='timestamp', how='inner', suffixes=['_1','_2'])
-                # output5 = pd.merge(output3, output4, on='timestamp', how='inner', suffixes=['_1','_2'])
-
-                data7 = pd.read_csv(root + '/' + folder + '/' + 'rpi-altitude-temperature.csv')
-                data8 = pd.read_csv(root + '/' + folder + '/' + 'rpi-secondary-compass.csv')
-                output6 = pd.merge(data7, data8, on='timestamp', how='inner', suffixes=['_1','_2'])
-                output7 = pd.merge(output3, output6, on='timestamp', how='inner', suffixes=['_1','_2'])
-                
-                output7.to_csv( save_path + '/' + folder + '/' + 'master-' + folder + '.csv', index=False, encoding='utf-8-sig')
-            except:
-                print("Skipping folder", folder)
-    for root, subdirectories, files in os.walk(save_path):
-        for file in files:
-            if file == 'master-' + root.split('/')[-1] + '.csv':
-                print("Generating map for", file)
-                try:
-                    df = import_csv_as_df(os.path.join(save_path, root.split('/')[-1]) + '/' + file)
-                    plot_coordinates_on_mapbox(df, os.path.join(save_path, root.split('/')[-1]) + '/' + file, os.path.join(save_path, root.split('/')[-1]))
-                except:
-                    print(sys.exc_info())
+SENSOR_FILES = ['rpi-coordinates.csv', 'rpi-kvh-compass.csv', 'rpi-doppler.csv', 'rpi-altitude-temperature.csv', 'rpi-secondary-compass.csv']
+MASTER_FILES = ['master-{folder}.csv']
+MAP_FILES = ['master-{folder}.html']
+# sessions with fewer coordinate rows are deleted rather than formatted
+MIN_ROWS = 1000
+CODE_VERSION = manifest.code_version(__file__, align.__file__, columnar.__file__, schema.__file__, report.__file__)
+
+def sensor_reads(root, folder):
+    """
+    Function to list the sensor csv files format_folder reads from one
+    session folder, as (stream name, read function, arguments) for
+    pipeline.read_files or prefetching.
+    """
+    return [('coordinates', schema.read_sensor_csv, (root + '/' + folder + '/' + 'rpi-coordinates.csv',)),
+            ('kvh-compass', schema.read_sensor_csv, (root + '/' + folder + '/' + 'rpi-kvh-compass.csv',)),
+            # ('imu', schema.read_sensor_csv, (root + '/' + folder + '/' + 'rpi-imu.csv',)),
+            ('doppler', schema.read_sensor_csv, (root + '/' + folder + '/' + 'rpi-doppler.csv',)),
+            # ('biodigital-imu', schema.read_sensor_csv, (root + '/' + folder + '/' + 'biodigital-imu.csv',)),
+            # ('biodigital-dmc', schema.read_sensor_csv, (root + '/' + folder + '/' + 'biodigital-dmc.csv',)),
+            ('altitude-temperature', schema.read_sensor_csv, (root + '/' + folder + '/' + 'rpi-altitude-temperature.csv',)),
+            ('secondary-compass', schema.read_sensor_csv, (root + '/' + folder + '/' + 'rpi-secondary-compass.csv',))]
+
+def write_master(master, csv_path, output_formats):
+    """
+    Function to write the master table in output_formats.
+    """
+    with metrics.stage('write', len(master)):
+        columnar.write_frame(master, csv_path, output_formats, encoding='utf-8-sig')
+
+def format_folder(root, folder, save_path, tolerance=0, direction='nearest', output_formats=('csv',), point_budget=report.POINT_BUDGET, plotlyjs='inline', reads=None, writer=None):
+    """
+    Function to join the sensor csv files of one session folder on their
+    timestamps into its master csv and/or its columnar copies, and plot the
+    master table on a map. Returns 'delete' for sessions too short to keep
+    or with no matching rows, otherwise the row count and per-stream match
+    rates. reads are the folder's files already being read and writer the
+    background writer to hand the table and map to, when run by
+    pipeline.run_folders.
+    """
+    streams = pipeline.collect(reads) if reads is not None else pipeline.read_files(sensor_reads(root, folder)[:1])
+    if len(streams[0][1].index) < MIN_ROWS:
+        return {'status': 'delete', 'reason': 'fewer than %d coordinate rows' % MIN_ROWS, 'rows': len(streams[0][1].index)}
+    if reads is None:
+        streams += pipeline.read_files(sensor_reads(root, folder)[1:])
+    master, match_rates = align.align_streams(streams, on='timestamp', tolerance=tolerance, direction=direction)
+    if master.empty:
+        return {'status': 'delete', 'reason': 'no rows matched across the sensor files', 'rows': 0}
+
+    csv_path = save_path + '/' + folder + '/' + 'master-' + folder + '.csv'
+    pipeline.write(writer, write_master, master, csv_path, output_formats)
+    pipeline.write(writer, plot_coordinates_on_mapbox, master, csv_path, point_budget, plotlyjs)
+    return {'rows': len(master), 'match_rates': match_rates}
+
+def map_folder(root, folder, point_budget=report.POINT_BUDGET, plotlyjs='inline'):
+    """
+    Function to plot the master csv of one session folder on a map. Returns
+    'skipped' when the folder has no master csv and 'delete' when the master
+    csv is empty.
+    """
+    file = 'master-' + folder + '.csv'
+    if columnar.find_frame(os.path.join(root, folder, file)) is None:
+        return {'status': 'skipped', 'reason': 'no master csv'}
+    df = metrics.timed('read master', import_csv_as_df, os.path.join(root, folder, file))
+    if df.empty:
+        return {'status': 'delete', 'reason': 'empty master csv'}
+    plot_coordinates_on_mapbox(df, os.path.join(root, folder, file), point_budget, plotlyjs)
 
+def iterate_through_files_in_folder(open_path, save_path, workers=1, force=False, only=None, tolerance=0, direction='nearest', output_formats=('csv',), point_budget=report.POINT_BUDGET, plotlyjs='inline', metrics_options=None, prefetch=pipeline.PREFETCH, pending_writes=pipeline.PENDING_WRITES):
+    """
+    Function to iterate through all session folders, write a master csv for
+    each and plot it on a map. tolerance and direction control how sensor
+    timestamps are matched and output_formats which of csv, parquet and
+    feather the master table is written in. Each map layer is thinned to
+    point_budget points. Folders whose sensor files and code are unchanged
+    since their last run are skipped unless force is set. The folders are
+    run by pipeline.run_folders, reading prefetch folders ahead and writing
+    in the background, and metrics_options are the instrumentation options
+    they are run with. Returns the per-folder results.
+    """
+    version = "%s-%s-%s-%s-%s" % (CODE_VERSION, tolerance, direction, point_budget, plotlyjs)
+    pipeline_manifest = manifest.load_manifest(open_path)
+    output_files = columnar.output_names(MASTER_FILES, output_formats) + MAP_FILES
+    folders, skipped, fingerprints = manifest.select_folders(pipeline_manifest, 'format', runner.list_session_folders(open_path), SENSOR_FILES, output_files, version, save_path, force, only)
+    results = pipeline.run_folders(format_folder, sensor_reads, folders, (save_path, tolerance, direction, output_formats, point_budget, plotlyjs), workers, metrics_options, prefetch, pending_writes)
+    runner.delete_folders(results)
+    manifest.record_folders(pipeline_manifest, 'format', results, fingerprints, version)
+    manifest.save_manifest(pipeline_manifest, open_path)
+    return skipped + results
 
 if __name__ == "__main__":
-    open_path = "/home/pi/MSRS-RPI/logs"
-    save_path = "/home/pi/MSRS-RPI/logs"
-    iterate_through_files_in_folder(open_path, save_path)
\ No newline at end of file
+    import sanddance
+    sys.exit(sanddance.main(['format'] + sys.argv[1:]))
@@ -0,0 +1,126 @@
+import lazy
+
+np = lazy.lazy_import('numpy')
+
+EARTH_RADIUS_KM = 6371.0088 # mean earth radius used by turfpy's haversine
+WGS84_A = 6378137.0 # semi-major axis in meters
+WGS84_F = 1 / 298.257223563 # flattening
+WGS84_B = (1 - WGS84_F) * WGS84_A # semi-minor axis in meters
+GEOJSON_PRECISION = 6 # geojson Points round coordinates to this many decimals
+
+
+def previous_values(values, first=None):
+    """
+    Function to shift an array down by one row. The first row gets first, the
+    last value of the rows before this block, or repeats itself so the first
+    row is compared with itself.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    previous = np.empty_like(values)
+    if len(values):
+        previous[0] = values[0] if first is None else first
+        previous[1:] = values[:-1]
+    return previous
+
+def compass_bearings(lat1, lat2, lon1, lon2):
+    """
+    Function to calculate the compass bearing from point 1 to point 2 for
+    whole arrays of coordinates. Matches calculate_compass_bearing.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    diff_long = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    x = np.sin(diff_long) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - (np.sin(lat1) * np.cos(lat2) * np.cos(diff_long))
+    initial_bearing = np.degrees(np.arctan2(x, y))
+    return (initial_bearing + 360) % 360
+
+def haversine_distances(lat1, lat2, lon1, lon2, precision=GEOJSON_PRECISION):
+    """
+    Function to calculate the haversine distance in km between two arrays of
+    coordinates. Coordinates are rounded to precision decimals first, the same
+    way geojson does, so the result matches get_turf_distance. Pass
+    precision=None to skip the rounding.
+    """
+    lat1, lat2, lon1, lon2 = (np.asarray(value, dtype=np.float64) for value in (lat1, lat2, lon1, lon2))
+    if precision is not None:
+        lat1, lat2, lon1, lon2 = (np.round(value, precision) for value in (lat1, lat2, lon1, lon2))
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    a = np.sin(dlat / 2) ** 2 + np.sin(dlon / 2) ** 2 * np.cos(lat1) * np.cos(lat2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return c * EARTH_RADIUS_KM
+
+def geodesic_distances(lat1, lon1, lat2, lon2, max_iterations=200, tolerance=1e-15):
+    """
+    Function to calculate the WGS-84 ellipsoidal distance in meters between two
+    arrays of coordinates using Vincenty's inverse formula. Agrees with geopy's
+    geodesic to well under a millimeter for the short baselines in our logs.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    L = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    U1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    # each element stops updating once it has converged, so a result does not
+    # depend on which other coordinates it was computed with
+    lam = L.copy()
+    active = np.ones(lam.shape, dtype=bool)
+    sin_sigma = cos_sigma = sigma = cos2_alpha = cos_2sigma_m = np.zeros(lam.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.where(active, np.sqrt((cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2), sin_sigma)
+            cos_sigma = np.where(active, sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam, cos_sigma)
+            sigma = np.where(active, np.arctan2(sin_sigma, cos_sigma), sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = np.where(active, 1 - sin_alpha ** 2, cos2_alpha)
+            cos_2sigma_m = np.where(active, np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha), cos_2sigma_m)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_next = L + (1 - C) * WGS84_F * sin_alpha * (sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam_next - lam) < tolerance
+            lam = np.where(active, lam_next, lam)
+            active &= ~converged
+            if not active.any():
+                break
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return WGS84_B * A * (sigma - delta_sigma)
+
+def carry_forward_bearings(bearings, initial_bearing=0):
+    """
+    Function to replace unreliable bearings with the previous good bearing.
+    A bearing of exactly 0 or one within [180, 181] or [270, 271] degrees is
+    treated as unreliable and the last good value (or initial_bearing) is
+    forward filled over it.
+    """
+    bearings = np.array(bearings, dtype=np.float64)
+    invalid = (bearings == 0) | ((bearings >= 180) & (bearings <= 181)) | ((bearings >= 270) & (bearings <= 271))
+    index = np.where(invalid, -1, np.arange(len(bearings)))
+    np.maximum.accumulate(index, out=index)
+    return np.where(index < 0, initial_bearing, bearings[np.maximum(index, 0)])
+
+def track_bearings(lats, lons, previous_lat=None, previous_lon=None, previous_bearing=0):
+    """
+    Function to calculate the carried-forward bearing of every point in a track
+    from the point before it. The previous_* arguments continue a track from
+    the last point and bearing of an earlier block of rows.
+    """
+    bearings = compass_bearings(previous_values(lats, previous_lat), lats, previous_values(lons, previous_lon), lons)
+    return carry_forward_bearings(bearings, previous_bearing)
+
+def track_distances(lats, lons, previous_lat=None, previous_lon=None):
+    """
+    Function to calculate the haversine distance in km of every point in a
+    track from the point before it. The previous_* arguments continue a track
+    from the last point of an earlier block of rows.
+    """
+    return haversine_distances(previous_values(lats, previous_lat), lats, previous_values(lons, previous_lon), lons)
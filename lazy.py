@@ -0,0 +1,34 @@
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    """
+    Function to return a module that is only really imported the first time
+    one of its attributes is used, so a run that never reaches the code
+    needing pandas, numpy or plotly does not pay for importing them. A
+    module that is already imported is returned as it is. A missing module
+    raises ImportError straight away, as a plain import would.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named %r" % name, name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def load(*modules):
+    """
+    Function to finish importing lazily imported modules now, e.g. before
+    threads that use them are started: before Python 3.12 two threads that
+    both trigger the same lazy import can import it twice.
+    """
+    for module in modules:
+        # any attribute access runs the deferred import
+        getattr(module, '__name__')
+    return modules
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = 'pipeline-manifest.json'
+
+
+def hash_file(file_path, block_size=1 << 20):
+    """
+    Function to return the sha1 hex digest of a file's contents.
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def code_version(*file_paths):
+    """
+    Function to return a version string for a pipeline stage built from the
+    contents of the source files it runs, so editing the code invalidates
+    every output the stage produced.
+    """
+    sha1 = hashlib.sha1()
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+def fingerprint_file(file_path, previous=None):
+    """
+    Function to return the size, mtime and sha1 of a file, or None if it does
+    not exist. The stored sha1 is reused when size and mtime are unchanged so
+    untouched files are never re-read.
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+        return previous
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': hash_file(file_path)}
+
+def same_contents(previous_inputs, inputs):
+    """
+    Function to check whether two sets of input fingerprints describe the same
+    file contents. Only size and sha1 are compared so a file that was merely
+    touched still counts as unchanged.
+    """
+    if previous_inputs.keys() != inputs.keys():
+        return False
+    for name, fingerprint in inputs.items():
+        previous = previous_inputs[name]
+        if (previous is None) != (fingerprint is None):
+            return False
+        if fingerprint is not None and (previous['size'], previous['sha1']) != (fingerprint['size'], fingerprint['sha1']):
+            return False
+    return True
+
+def load_manifest(root_path):
+    """
+    Function to load the manifest stored in root_path, or an empty one.
+    """
+    try:
+        with open(os.path.join(root_path, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(manifest, root_path):
+    """
+    Function to write the manifest to root_path, replacing the old one in a
+    single rename so an interrupted run never leaves a half-written file.
+    """
+    manifest_path = os.path.join(root_path, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def select_folders(manifest, stage, folders, input_names, output_names, version, output_root=None, force=False, only=None):
+    """
+    Function to split (root, folder) pairs into the ones that need to run and
+    the ones whose inputs, code version and outputs are unchanged since the
+    last successful run of stage. Returns the folders to run, a result dict
+    for every skipped folder and the input fingerprints of the folders to
+    run, to be passed to record_folders once they have finished.
+    """
+    entries = manifest.get(stage, {})
+    pending = []
+    skipped = []
+    fingerprints = {}
+    for root, folder in folders:
+        if only is not None and folder != only:
+            continue
+        folder_path = os.path.join(root, folder)
+        entry = entries.get(folder_path, {})
+        previous_inputs = entry.get('inputs', {})
+        inputs = {name: fingerprint_file(os.path.join(folder_path, name), previous_inputs.get(name)) for name in input_names}
+        outputs = [os.path.join(output_root or root, folder, name.format(folder=folder)) for name in output_names]
+        if not force and entry.get('version') == version and same_contents(previous_inputs, inputs) and all(os.path.exists(output) for output in outputs):
+            entry['inputs'] = inputs
+            skipped.append({'root': root, 'folder': folder, 'status': 'unchanged', 'reason': 'inputs, code and options unchanged since the last run', 'seconds': 0.0, 'error': None})
+        else:
+            pending.append((root, folder))
+            fingerprints[folder_path] = inputs
+    return pending, skipped, fingerprints
+
+def record_folders(manifest, stage, results, fingerprints, version):
+    """
+    Function to store the input fingerprints and code version of every folder
+    that finished with status 'ok' and to forget every folder that did not.
+    """
+    entries = manifest.setdefault(stage, {})
+    for result in results:
+        folder_path = os.path.join(result['root'], result['folder'])
+        if folder_path not in fingerprints:
+            continue
+        if result['status'] == 'ok':
+            entries[folder_path] = {'version': version, 'inputs': fingerprints[folder_path]}
+        else:
+            entries.pop(folder_path, None)
+    return manifest
+
+def add_manifest_arguments(parser):
+    """
+    Function to add the shared --force and --only options to an argparse
+    parser.
+    """
+    parser.add_argument('--force', action='store_true', help='reprocess every session folder even if its inputs are unchanged')
+    parser.add_argument('--only', metavar='FOLDER', help='only process the session folder with this name')
+    return parser
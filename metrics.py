@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+
+# options of the current process: quiet, profile_dir, trace_memory and
+# messages_to_stderr
+_options = {}
+# per thread: the recording of the folder the thread is working on, if any,
+# how deep in stages it is and whether it is a background reader or writer
+_thread = threading.local()
+# guards the stage totals and warnings a folder's threads add to
+_lock = threading.Lock()
+_END = object()
+
+
+def configure(options=None):
+    """
+    Function to set the instrumentation options of the current process.
+    """
+    global _options
+    _options = dict(options or {})
+
+def quiet():
+    """
+    Function to return whether progress messages are suppressed.
+    """
+    return bool(_options.get('quiet'))
+
+def message_stream():
+    """
+    Function to return the stream progress messages and results are printed
+    to: stderr when the metrics records are written to stdout, otherwise
+    stdout.
+    """
+    return sys.stderr if _options.get('messages_to_stderr') else sys.stdout
+
+def say(message, stream=None):
+    """
+    Function to print a progress message unless running quietly. Messages
+    go to stderr when stdout carries the metrics records.
+    """
+    if not quiet():
+        print(message, file=stream or message_stream())
+
+def warn(message):
+    """
+    Function to report a problem that did not stop the folder, e.g. a map
+    that could not be drawn. The message is kept with the folder's stage
+    records and printed to stderr unless running quietly.
+    """
+    recording = current_recording()
+    if recording is not None:
+        with _lock:
+            recording['warnings'].append(message)
+    if not quiet():
+        print(message, file=sys.stderr)
+
+def reset_peak_memory(trace_memory=False):
+    """
+    Function to restart peak memory tracking at the current usage: the
+    traced allocation peak with trace_memory, otherwise the process's peak
+    resident set size where the kernel allows it to be reset (Linux).
+    """
+    if trace_memory:
+        tracemalloc.reset_peak()
+        return
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_memory(trace_memory=False):
+    """
+    Function to return the peak memory in bytes since the last
+    reset_peak_memory: the peak of the allocations traced by tracemalloc
+    (python objects and numpy arrays) with trace_memory, otherwise the
+    process's peak resident set size. Where the peak cannot be reset it is
+    the peak of the whole process so far. None when it cannot be read.
+    """
+    if trace_memory:
+        return tracemalloc.get_traced_memory()[1]
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+def new_recording(function_name, folder):
+    """
+    Function to return an empty recording of one folder's stages, e.g. to
+    record the reads of a folder prefetched before start_folder is called.
+    """
+    return {'function': function_name, 'folder': folder, 'stages': {}, 'warnings': [], 'profile': None}
+
+def current_recording():
+    """
+    Function to return the recording of the folder the current thread is
+    working on, or None.
+    """
+    return getattr(_thread, 'recording', None)
+
+def start_folder(function_name, folder, options=None, recording=None):
+    """
+    Function to start recording the stages of one folder in this thread,
+    adding to recording when given, and to start its profiler when options
+    has a profile_dir. Only this thread is profiled. Returns the recording
+    to pass to finish_folder.
+    """
+    configure(options)
+    if _options.get('trace_memory') and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if recording is None:
+        recording = new_recording(function_name, folder)
+    _thread.recording, _thread.depth, _thread.background = recording, 0, False
+    if _options.get('profile_dir'):
+        recording['profile'] = cProfile.Profile()
+        recording['profile'].enable()
+    return recording
+
+def finish_folder(recording):
+    """
+    Function to stop recording a folder in this thread, writing its profile
+    to {profile_dir}/{function}-{folder}.prof if it was profiled. Returns a
+    dict of the stage records and warnings to add to the folder's result.
+    """
+    _thread.recording = None
+    if recording['profile'] is not None:
+        recording['profile'].disable()
+        os.makedirs(_options['profile_dir'], exist_ok=True)
+        recording['profile'].dump_stats(os.path.join(_options['profile_dir'], '%s-%s.prof' % (recording['function'], recording['folder'])))
+        recording['profile'] = None
+    return recording_summary(recording)
+
+def recording_summary(recording):
+    """
+    Function to return a dict of the stage records and warnings of a
+    recording, to add to the folder's result.
+    """
+    summary = {}
+    with _lock:
+        if recording['stages']:
+            summary['stages'] = [dict(total) for total in recording['stages'].values()]
+        if recording['warnings']:
+            summary['warnings'] = list(recording['warnings'])
+    return summary
+
+@contextlib.contextmanager
+def attach(recording):
+    """
+    Function to record the stages and warnings of a background thread, e.g.
+    one reading or writing a folder's files, with that folder's recording,
+    as a with block. Peak memory is per process, so background stages do
+    not reset or measure it and the stages of the thread computing the
+    folder keep their own peaks.
+    """
+    previous = (current_recording(), getattr(_thread, 'depth', 0), getattr(_thread, 'background', False))
+    _thread.recording, _thread.depth, _thread.background = recording, 0, True
+    try:
+        yield recording
+    finally:
+        _thread.recording, _thread.depth, _thread.background = previous
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """
+    Function to time a pipeline stage of the folder being recorded, as a
+    with block. The block may set rows on the dict it is given. A stage run
+    several times, e.g. once per chunk, is added up into one record with the
+    number of calls. A stage inside another stage is timed but only the
+    outer one measures peak memory. Outside a recorded folder it does
+    nothing. Cpu time is the whole process's, so it includes the background
+    threads working at the same time.
+    """
+    record = {'rows': rows}
+    recording = current_recording()
+    if recording is None:
+        yield record
+        return
+    outermost = _thread.depth == 0 and not _thread.background
+    trace_memory = bool(_options.get('trace_memory'))
+    if outermost:
+        reset_peak_memory(trace_memory)
+    _thread.depth += 1
+    start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+        _thread.depth -= 1
+        peak = peak_memory(trace_memory) if outermost else None
+        with _lock:
+            total = recording['stages'].setdefault(name, {'stage': name, 'seconds': 0.0, 'cpu_seconds': 0.0, 'peak_memory': None, 'rows': None, 'calls': 0})
+            total['seconds'] += seconds
+            total['cpu_seconds'] += cpu_seconds
+            total['calls'] += 1
+            if peak is not None:
+                total['peak_memory'] = max(peak, total['peak_memory'] or 0)
+            if record['rows'] is not None:
+                total['rows'] = (total['rows'] or 0) + int(record['rows'])
+
+def timed(name, function, *args, **kwargs):
+    """
+    Function to call function(*args, **kwargs) as a stage, counting the rows
+    of the dataframe or array it returns.
+    """
+    with stage(name) as record:
+        value = function(*args, **kwargs)
+        if hasattr(value, 'shape'):
+            record['rows'] = value.shape[0]
+    return value
+
+def timed_chunks(name, chunks):
+    """
+    Function to time reading every chunk of an iterator of dataframes as one
+    stage, counting their rows.
+    """
+    chunks = iter(chunks)
+    while True:
+        with stage(name) as record:
+            chunk = next(chunks, _END)
+            if chunk is not _END:
+                record['rows'] = len(chunk)
+        if chunk is _END:
+            return
+        yield chunk
+
+def json_value(value):
+    """
+    Function to turn the numpy numbers in a record into plain json values.
+    """
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def result_records(results, script):
+    """
+    Function to return the json-lines records of a run's folder results:
+    one 'folder' record per result, with its status, skip reason, row count
+    and match rates, followed by one 'stage' record per stage it ran.
+    """
+    records = []
+    for result in results:
+        details = result.get('details', {})
+        records.append({'record': 'folder', 'script': script, 'root': result['root'], 'folder': result['folder'], 'status': result['status'], 'reason': result.get('reason'),
+                        'seconds': result['seconds'], 'error': result['error'], 'rows': details.get('rows'), 'match_rates': details.get('match_rates'), 'warnings': result.get('warnings', [])})
+        for stage_record in result.get('stages', []):
+            records.append(dict({'record': 'stage', 'script': script, 'folder': result['folder']}, **stage_record))
+    return records
+
+def write_records(results, path, script, started):
+    """
+    Function to append the records of a run to the json-lines file at path,
+    or print them when path is '-', ending with a 'run' record holding the
+    run's start time, duration and the number of folders per status.
+    """
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+    run = {'record': 'run', 'script': script, 'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)), 'seconds': time.time() - started, 'folders': len(results), 'statuses': statuses}
+    lines = "".join(json.dumps(record, default=json_value) + "\n" for record in result_records(results, script) + [run])
+    if path == '-':
+        sys.stdout.write(lines)
+        return
+    with open(path, 'a') as f:
+        f.write(lines)
+
+def options_from_args(args):
+    """
+    Function to return the instrumentation options given on the command line.
+    With --metrics - the messages move to stderr, keeping stdout json lines.
+    """
+    return {'quiet': args.quiet, 'profile_dir': args.profile, 'trace_memory': args.trace_memory, 'messages_to_stderr': args.metrics == '-'}
+
+def add_metrics_arguments(parser):
+    """
+    Function to add the shared --quiet, --metrics, --profile and
+    --trace-memory options to an argparse parser.
+    """
+    parser.add_argument('--quiet', '-q', action='store_true', help='no progress messages or warnings, and only failed folders in the results')
+    parser.add_argument('--metrics', metavar='FILE', help="append a json-lines record of every folder and pipeline stage (time, cpu time, peak memory, rows) to FILE, '-' for stdout")
+    parser.add_argument('--profile', metavar='DIR', help='write a cProfile dump of every folder to DIR, e.g. for python -m pstats or snakeviz')
+    parser.add_argument('--trace-memory', action='store_true', help='measure the peak of python and numpy allocations with tracemalloc instead of the peak resident memory (slower)')
+    return parser
@@ -0,0 +1,159 @@
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import runner
+import metrics
+import lazy
+
+np = lazy.lazy_import('numpy')
+pd = lazy.lazy_import('pandas')
+
+# threads reading the files of the folders ahead, one per file at a time
+READ_THREADS = 4
+PREFETCH = 1
+PENDING_WRITES = 2
+
+
+def read_files(reads):
+    """
+    Function to read a folder's files now, one after the other. reads lists
+    them as (name, function, args) and each is timed as a 'read {name}'
+    stage. Returns a list of (name, data) pairs.
+    """
+    return [(name, metrics.timed('read ' + name, function, *args)) for name, function, args in reads]
+
+def read_attached(recording, name, function, args):
+    """
+    Function to read one file of a prefetched folder on a reader thread,
+    timing it with the folder's stages.
+    """
+    with metrics.attach(recording):
+        return metrics.timed('read ' + name, function, *args)
+
+def prefetch_files(pool, reads, recording):
+    """
+    Function to start reading a folder's files on the reader pool. Returns
+    the list of (name, future) pairs to pass to the folder function.
+    """
+    return [(name, pool.submit(read_attached, recording, name, function, args)) for name, function, args in reads]
+
+def collect(pending):
+    """
+    Function to wait for the prefetched files of the current folder and
+    return them as (name, data) pairs. The time spent waiting, i.e. the
+    reads that did not finish while the previous folder was computed, is
+    the 'wait for reads' stage. A read that failed raises here, failing the
+    folder.
+    """
+    with metrics.stage('wait for reads'):
+        return [(name, future.result()) for name, future in pending]
+
+def open_writer(pending_writes=PENDING_WRITES):
+    """
+    Function to start a background writer: one thread writing the csv,
+    columnar and html outputs handed to it in order, so the next folder is
+    computed while they are written. At most pending_writes writes wait or
+    run at once; handing over another blocks until one is done, so the
+    frames held for writing stay bounded.
+    """
+    return {'executor': ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer'), 'slots': threading.BoundedSemaphore(max(1, pending_writes)), 'futures': {}}
+
+def write(writer, function, *args, **kwargs):
+    """
+    Function to call function(*args, **kwargs) on the background writer, or
+    right away when writer is None. Its stages and warnings are recorded
+    with the folder that handed it over. The arguments must not be changed
+    afterwards, as they are written later.
+    """
+    if writer is None:
+        function(*args, **kwargs)
+        return
+    recording = metrics.current_recording()
+    writer['slots'].acquire()
+    def run():
+        try:
+            with metrics.attach(recording):
+                function(*args, **kwargs)
+        finally:
+            writer['slots'].release()
+    writer['futures'].setdefault(id(recording), []).append(writer['executor'].submit(run))
+
+def close_writer(writer):
+    """
+    Function to wait for every write handed to a background writer. Returns
+    a dict of the error message of the first write that failed for each
+    folder recording id.
+    """
+    writer['executor'].shutdown(wait=True)
+    errors = {}
+    for key, futures in writer['futures'].items():
+        for future in futures:
+            error = future.exception()
+            if error is not None:
+                errors[key] = ''.join(traceback.format_exception_only(type(error), error)).strip()
+                break
+    return errors
+
+def run_batch(function, plan, folders, args=(), options=None, prefetch=PREFETCH, pending_writes=PENDING_WRITES):
+    """
+    Function to run function(root, folder, *args, reads=..., writer=...) for
+    every (root, folder) pair in turn while the files plan(root, folder)
+    lists for the next prefetch folders are read on a thread pool and the
+    outputs of the previous ones are written by a background writer. A
+    folder whose writes fail is marked failed. Returns the list of result
+    dicts in the same order as folders.
+    """
+    if not folders:
+        return []
+    metrics.configure(options)
+    # finish the lazy imports before the reader and writer threads can race to do them
+    lazy.load(np, pd)
+    writer = open_writer(pending_writes)
+    finished = []
+    try:
+        with ThreadPoolExecutor(max_workers=READ_THREADS, thread_name_prefix='reader') as pool:
+            queued = deque()
+            for index, (root, folder) in enumerate(folders):
+                while len(finished) + len(queued) < min(len(folders), index + 1 + prefetch):
+                    next_root, next_folder = folders[len(finished) + len(queued)]
+                    recording = metrics.new_recording(function.__name__, next_folder)
+                    queued.append((recording, prefetch_files(pool, plan(next_root, next_folder), recording)))
+                recording, pending = queued.popleft()
+                result = runner.run_folder(function, root, folder, args, options, recording, {'reads': pending, 'writer': writer})
+                finished.append((result, recording))
+    finally:
+        errors = close_writer(writer)
+    for result, recording in finished:
+        # add the stages and warnings of the writes finished after the folder
+        result.update(metrics.recording_summary(recording))
+        if id(recording) in errors and result['status'] != 'failed':
+            result['status'], result['error'] = 'failed', errors[id(recording)]
+    return [result for result, recording in finished]
+
+def run_folders(function, plan, folders, args=(), workers=1, options=None, prefetch=PREFETCH, pending_writes=PENDING_WRITES):
+    """
+    Function to run a folder function over every (root, folder) pair as
+    pipelined batches (see run_batch): one inline with workers=1, otherwise
+    one per worker process, each taking every workers-th folder. With
+    prefetch=0 every folder is read, computed and written in turn by
+    runner.run_folders instead. Returns the list of result dicts in the same
+    order as folders.
+    """
+    if prefetch <= 0:
+        return runner.run_folders(function, folders, args, workers, options)
+    if workers <= 1 or len(folders) <= 1:
+        return run_batch(function, plan, folders, args, options, prefetch, pending_writes)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_batch, function, plan, folders[start::workers], args, options, prefetch, pending_writes) for start in range(min(workers, len(folders)))]
+        results = {(result['root'], result['folder']): result for future in futures for result in future.result()}
+    return [results[(root, folder)] for root, folder in folders]
+
+def add_pipeline_arguments(parser):
+    """
+    Function to add the shared --prefetch and --pending-writes options to an
+    argparse parser.
+    """
+    parser.add_argument('--prefetch', type=int, default=PREFETCH, help='number of session folders to read ahead while the current one is computed, 0 to read, compute and write each folder in turn (default: %d)' % PREFETCH)
+    parser.add_argument('--pending-writes', type=int, default=PENDING_WRITES, help='number of map, chart and table writes that may wait for the background writer before computing pauses (default: %d)' % PENDING_WRITES)
+    return parser
@@ -0,0 +1,206 @@
+import os
+import argparse
+import lazy
+
+np = lazy.lazy_import('numpy')
+go = lazy.lazy_import('plotly.graph_objects')
+plotly_subplots = lazy.lazy_import('plotly.subplots')
+
+POINT_BUDGET = 5000 # points kept per line series and per map layer
+DECIMATION_METHODS = ('lttb', 'minmax')
+_dotenv_loaded = False
+
+
+def lttb_indices(x, y, budget):
+    """
+    Function to pick budget rows of a line series with Largest-Triangle-
+    Three-Buckets: the first and last rows plus, from each bucket in
+    between, the row forming the largest triangle with the row kept before
+    it and the mean of the next bucket. This keeps the shape of the line,
+    peaks included. NaN rows are never picked over a number.
+    """
+    count = len(y)
+    if budget <= 0 or budget >= count or budget < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = (np.arange(budget - 1) * (count - 2) / (budget - 2)).astype(np.intp) + 1
+    edges[-1] = count - 1
+    # the mean point of every bucket after the first, and of the last row
+    valid = ~np.isnan(y)
+    starts = np.append(edges[1:-1], count - 1)
+    next_x = np.add.reduceat(x, starts) / np.diff(np.append(starts, count))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        next_y = np.add.reduceat(np.where(valid, y, 0.0), starts) / np.add.reduceat(valid, starts)
+    indices = np.empty(budget, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = count - 1
+    kept = 0
+    for bucket in range(budget - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        kept_x, kept_y = x[kept], y[kept]
+        mean_y = next_y[bucket] if not np.isnan(next_y[bucket]) else kept_y
+        area = np.abs((kept_x - next_x[bucket]) * (y[start:end] - kept_y) - (kept_x - x[start:end]) * (mean_y - kept_y))
+        kept = start + int(np.argmax(np.where(np.isnan(area), -1.0, area)))
+        indices[bucket + 1] = kept
+    return indices
+
+def minmax_indices(y, budget):
+    """
+    Function to pick about budget rows of a line series by keeping the
+    smallest and largest value of each of budget / 2 equal buckets, plus the
+    first and last rows. Cheaper than LTTB and never hides a spike.
+    """
+    count = len(y)
+    buckets = budget // 2
+    if budget <= 0 or budget >= count or buckets < 1:
+        return np.arange(count)
+    size = -(-count // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:count] = y
+    padded = padded.reshape(buckets, size)
+    first = np.arange(buckets) * size
+    lowest = first + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    highest = first + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+    indices = np.unique(np.concatenate(([0, count - 1], lowest, highest)))
+    return indices[indices < count]
+
+def decimate(x, y, budget=POINT_BUDGET, method='lttb'):
+    """
+    Function to return the row indices kept when a line series is drawn
+    with at most about budget points. A budget of 0 keeps every row.
+    """
+    if method not in DECIMATION_METHODS:
+        raise ValueError("decimation method must be one of %s, not %r" % (DECIMATION_METHODS, method))
+    if method == 'lttb':
+        return lttb_indices(x, y, budget)
+    return minmax_indices(y, budget)
+
+def thin_points(lat, lon, budget=POINT_BUDGET):
+    """
+    Function to return the row indices, in track order, of at most budget
+    map points spread over the area the track covers. Points are snapped to
+    a square grid that is coarsened until no more than budget cells are
+    occupied, and the first point in each cell is kept. Rows without a fix
+    are dropped.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lon))
+    if budget <= 0 or len(valid) <= budget:
+        return valid
+    lat = lat[valid]
+    lon = lon[valid]
+    lat_min, lon_min = lat.min(), lon.min()
+    extent = max(lat.max() - lat_min, lon.max() - lon_min)
+    if extent == 0:
+        return valid[:1]
+    # start at the finest grid a track across the whole extent could fill
+    cell = extent / budget
+    while True:
+        rows = np.floor((lat - lat_min) / cell).astype(np.int64)
+        columns = np.floor((lon - lon_min) / cell).astype(np.int64)
+        cells, first = np.unique(rows * (columns.max() + 1) + columns, return_index=True)
+        if len(cells) <= budget:
+            return valid[np.sort(first)]
+        cell *= 1.25
+
+def plotlyjs_option(plotlyjs):
+    """
+    Function to translate the --plotlyjs choice to write_html's
+    include_plotlyjs: 'inline' embeds plotly.js once so the report works
+    offline, 'cdn' loads it from the web for a much smaller file.
+    """
+    return True if plotlyjs == 'inline' else 'cdn'
+
+def line_report(df, columns, save_path, x=None, title=None, overlay=False, colors=None, budget=POINT_BUDGET, method='lttb', plotlyjs='inline', height=400):
+    """
+    Function to write a line chart of columns of a dataframe to save_path
+    as one html file that loads plotly.js once. Each column is decimated to
+    budget points on its own. overlay draws every column on one set of axes,
+    otherwise each column gets its own subplot with a shared x axis. x is
+    the column to plot against, or None for the row number.
+    """
+    x_values = np.arange(len(df)) if x is None else df[x].to_numpy()
+    if overlay:
+        fig = go.Figure()
+        fig.update_layout(height=height * 2)
+    else:
+        fig = plotly_subplots.make_subplots(rows=len(columns), cols=1, shared_xaxes=True, subplot_titles=columns, vertical_spacing=min(0.3 / max(len(columns), 1), 0.05))
+        fig.update_layout(height=height * len(columns), showlegend=False)
+    for position, column in enumerate(columns):
+        y_values = df[column].to_numpy(dtype=np.float64)
+        kept = decimate(x_values, y_values, budget, method)
+        line = {'color': colors[position]} if colors else {}
+        trace = go.Scattergl(x=x_values[kept], y=y_values[kept], mode='lines', name=column, line=line)
+        if overlay:
+            fig.add_trace(trace)
+        else:
+            fig.add_trace(trace, row=position + 1, col=1)
+    fig.update_layout(title=title, title_font_color="red", title_x=0.5, title_font_size=18)
+    fig.write_html(save_path, include_plotlyjs=plotlyjs_option(plotlyjs))
+    return fig
+
+def map_layer(df, lat, lon, name=None, color=None, color_column=None, colorscale=None, hover_columns=(), budget=POINT_BUDGET):
+    """
+    Function to build one thinned map trace of a dataframe's lat/lon
+    columns. The markers are drawn in color, or coloured by color_column on
+    colorscale, and hover_columns are shown when a point is hovered.
+    """
+    kept = thin_points(df[lat].to_numpy(), df[lon].to_numpy(), budget)
+    rows = df.iloc[kept]
+    marker = {'color': color} if color else {}
+    if color_column is not None:
+        marker = {'color': rows[color_column].to_numpy(), 'colorscale': colorscale or 'Plasma', 'showscale': True, 'colorbar': {'title': color_column}}
+    hover_columns = [column for column in hover_columns if column in df.columns]
+    hovertemplate = "%s=%%{lat}<br>%s=%%{lon}" % (lat, lon) + "".join("<br>%s=%%{customdata[%d]}" % (column, position) for position, column in enumerate(hover_columns))
+    customdata = rows[hover_columns].to_numpy() if hover_columns else None
+    return go.Scattermapbox(lat=rows[lat].to_numpy(), lon=rows[lon].to_numpy(), mode='markers', name=name or lat[:-len('_lat')], marker=marker, customdata=customdata, hovertemplate=hovertemplate + "<extra></extra>")
+
+def density_layer(lat, lon, values, name=None, radius=20, colorscale='Inferno'):
+    """
+    Function to build a map heatmap trace of values at lat/lon points, each
+    point spread over radius pixels.
+    """
+    return go.Densitymapbox(lat=lat, lon=lon, z=values, radius=radius, name=name, colorscale=colorscale, colorbar={'title': name})
+
+def mapbox_token():
+    """
+    Function to return the mapbox token from the MAPBOX environment
+    variable, loading the .env file the first time a map is drawn rather
+    than on every run.
+    """
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _dotenv_loaded = True
+    return os.environ.get("MAPBOX")
+
+def map_report(layers, save_path, center, zoom=12, style='dark', plotlyjs='inline'):
+    """
+    Function to write map layers built by map_layer to save_path as one
+    html file that loads plotly.js once, with the token from mapbox_token.
+    """
+    fig = go.Figure(layers)
+    fig.update_layout(mapbox={'accesstoken': mapbox_token(), 'style': style, 'center': center, 'zoom': zoom}, margin={'l': 0, 'r': 0, 't': 30, 'b': 0}, legend={'x': 0, 'y': 1})
+    fig.write_html(save_path, include_plotlyjs=plotlyjs_option(plotlyjs))
+    return fig
+
+def parse_budget(text):
+    """
+    Function to parse a --point-budget value, 0 meaning keep every point.
+    """
+    budget = int(text)
+    if budget < 0:
+        raise argparse.ArgumentTypeError("the point budget cannot be negative")
+    return budget
+
+def add_report_arguments(parser):
+    """
+    Function to add the shared --point-budget and --plotlyjs options to an
+    argparse parser.
+    """
+    parser.add_argument('--point-budget', type=parse_budget, default=POINT_BUDGET, help='points kept per chart line and per map layer, 0 keeps every point (default: %d)' % POINT_BUDGET)
+    parser.add_argument('--plotlyjs', choices=('inline', 'cdn'), default='inline', help='embed plotly.js in each report so it opens offline, or load it from the cdn for smaller files (default: inline)')
+    return parser
@@ -0,0 +1,132 @@
+import os
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import metrics
+
+# every session folder the logger writes has a coordinates log
+SESSION_FILE = 'rpi-coordinates.csv'
+
+
+def list_session_folders(open_path):
+    """
+    Function to list every (root, folder) pair under open_path whose folder
+    holds a coordinates log, so stray folders such as a profile directory
+    are left alone. The walk is finished before any folder is processed, so
+    folders can be deleted or written to without disturbing os.walk.
+    """
+    folders = []
+    for root, subdirectories, files in os.walk(open_path):
+        for folder in subdirectories:
+            if os.path.isfile(os.path.join(root, folder, SESSION_FILE)):
+                folders.append((root, folder))
+    return folders
+
+def run_folder(function, root, folder, args, options=None, recording=None, kwargs=None):
+    """
+    Function to run function(root, folder, *args, **kwargs) and return a
+    result dict with the folder, status, run time and error message (if
+    any), plus the stage records and warnings metrics collected while it
+    ran. The function may return a status string, a dict of details with
+    optional 'status' and 'reason' keys, or None for 'ok'. options are the
+    metrics options and recording the one to add the stages to, if the
+    folder's recording was started early.
+    """
+    start = time.perf_counter()
+    details = None
+    reason = None
+    recording = metrics.start_folder(function.__name__, folder, options, recording)
+    try:
+        outcome = function(root, folder, *args, **(kwargs or {}))
+        error = None
+        if isinstance(outcome, dict):
+            details = dict(outcome)
+            outcome = details.pop('status', None)
+            reason = details.pop('reason', None)
+        status = outcome or 'ok'
+    except Exception as e:
+        status = 'failed'
+        error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+    result = {'root': root, 'folder': folder, 'status': status, 'seconds': time.perf_counter() - start, 'error': error}
+    if reason:
+        result['reason'] = reason
+    if details:
+        result['details'] = details
+    result.update(metrics.finish_folder(recording))
+    return result
+
+def run_folders(function, folders, args=(), workers=1, options=None):
+    """
+    Function to run function(root, folder, *args) for every (root, folder)
+    pair, either inline (workers=1) or on a process pool, and return the
+    list of result dicts in the same order as folders. options are the
+    metrics options each worker records the folders with.
+    """
+    if workers <= 1 or len(folders) <= 1:
+        return [run_folder(function, root, folder, args, options) for root, folder in folders]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_folder, function, root, folder, args, options) for root, folder in folders]
+        return [future.result() for future in futures]
+
+def delete_folders(results):
+    """
+    Function to delete every folder whose result status is 'delete'. Runs
+    after the pool has finished so no worker is still using the folder.
+    """
+    for result in results:
+        if result['status'] == 'delete':
+            folder_path = os.path.join(result['root'], result['folder'])
+            try:
+                shutil.rmtree(folder_path)
+                result['status'] = 'deleted'
+            except OSError as e:
+                result['status'] = 'failed'
+                result['error'] = "%s : %s" % (folder_path, e.strerror)
+    return results
+
+def format_detail(value):
+    """
+    Function to format a result detail for print_results, rounding floats.
+    """
+    if isinstance(value, float):
+        return "%.3g" % value
+    if isinstance(value, dict):
+        return "{%s}" % ", ".join("%s: %s" % (key, format_detail(item)) for key, item in value.items())
+    return str(value)
+
+def print_results(results, stream=sys.stdout, quiet=False):
+    """
+    Function to print one line per folder result plus a summary line. When
+    quiet only the folders that failed are listed.
+    """
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        if quiet and result['status'] != 'failed':
+            continue
+        line = "%-8s %8.2fs  %s" % (result['status'], result['seconds'], result['folder'])
+        if result['error']:
+            line += "  " + result['error']
+        if result.get('reason'):
+            line += "  (%s)" % result['reason']
+        for key, value in result.get('details', {}).items():
+            line += "  %s=%s" % (key, format_detail(value))
+        print(line, file=stream)
+    total = sum(result['seconds'] for result in results)
+    print("%d folders, %s, %.2fs total" % (len(results), ", ".join("%d %s" % (counts[status], status) for status in sorted(counts)), total), file=stream)
+
+def exit_code(results):
+    """
+    Function to return the process exit code for a run: 1 if any folder
+    failed, otherwise 0.
+    """
+    return 1 if any(result['status'] == 'failed' for result in results) else 0
+
+def add_worker_argument(parser):
+    """
+    Function to add the shared --workers option to an argparse parser.
+    """
+    parser.add_argument('--workers', type=int, default=1, help='number of session folders to process in parallel (default: 1)')
+    return parser
@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import argparse
+import runner
+import manifest
+import align
+import columnar
+import windows
+import report
+import metrics
+import pipeline
+import format
+import calculate_drift
+import follow
+import sweep
+import spatial_index
+
+LOG_PATH = '/home/pi/MSRS-RPI/logs'
+
+
+def plot_folder(root, folder, point_budget=report.POINT_BUDGET, plotlyjs='inline'):
+    """
+    Function to redraw the master map and the drift map and line chart of
+    one session folder from the tables already written for it. Returns
+    'skipped' when the folder has neither table.
+    """
+    plots = []
+    if format.map_folder(root, folder, point_budget, plotlyjs) is None:
+        plots.append('master map')
+    if calculate_drift.plot_folder(root, folder, point_budget, plotlyjs).get('status') is None:
+        plots.append('drift map and chart')
+    if not plots:
+        return {'status': 'skipped', 'reason': 'no master or analyzed table'}
+    return {'plots': plots}
+
+def finish(args, script, results, started):
+    """
+    Function to write the metrics records of a run if asked to, print its
+    results and return the exit code.
+    """
+    if args.metrics:
+        metrics.write_records(results, args.metrics, script, started)
+    runner.print_results(results, metrics.message_stream(), quiet=args.quiet)
+    return runner.exit_code(results)
+
+def run_format(args, started):
+    """
+    Function to run the format command.
+    """
+    results = format.iterate_through_files_in_folder(args.log_path, args.save_path or args.log_path, args.workers, args.force, args.only, args.tolerance, args.direction, args.output_format, args.point_budget, args.plotlyjs, metrics.options_from_args(args), args.prefetch, args.pending_writes)
+    return finish(args, 'format', results, started)
+
+def run_drift(args, started):
+    """
+    Function to run the drift command.
+    """
+    results = calculate_drift.calculate_drift(args.log_path, args.log_path, args.workers, args.force, args.only, args.tolerance, args.direction, args.chunk_size, args.output_format, args.window, args.window_size, args.point_budget, args.plotlyjs, metrics.options_from_args(args), args.prefetch, args.pending_writes)
+    return finish(args, 'drift', results, started)
+
+def run_plot(args, started):
+    """
+    Function to run the plot command. Nothing is deleted or recalculated,
+    and every folder is redrawn whether or not its tables changed.
+    """
+    folders = [(root, folder) for root, folder in runner.list_session_folders(args.log_path) if args.only is None or folder == args.only]
+    results = runner.run_folders(plot_folder, folders, (args.point_budget, args.plotlyjs), args.workers, metrics.options_from_args(args))
+    return finish(args, 'plot', results, started)
+
+def run_follow(args, started):
+    """
+    Function to run the follow command: follow the given session folder, or
+    the newest one under the log folder, and with --keep-following each
+    session recorded after it.
+    """
+    followed = None
+    while True:
+        folder_path = args.folder_path or follow.newest_session_folder(args.log_path)
+        if folder_path is None or folder_path == followed:
+            if not args.keep_following:
+                return 0
+            time.sleep(args.interval)
+            continue
+        result = follow.follow_session(folder_path, None if args.folder_path else args.log_path, args.interval, args.summary_interval, args.idle_timeout, args.tolerance, args.direction, args.window, args.window_size, args.output_format)
+        followed = folder_path
+        if result['status'] == 'failed':
+            print(result['error'], file=sys.stderr)
+            return 1
+        if args.folder_path or not args.keep_following or result['details']['stopped_by'] == 'interrupted':
+            return 0
+
+def run_sweep(args, started):
+    """
+    Function to run the sweep command and write the ranked table.
+    """
+    values = {'doppler_compensation_factor': args.doppler_factor, 'compass_vehicle_alignment_error': args.alignment_error, 'increment_value': [int(value) for value in args.increment], 'drift_threshold': args.threshold}
+    if min(values['increment_value']) < 1:
+        args.error('drift window sizes must be at least 1 row')
+    combinations = sweep.random_combinations(values, args.random, args.seed) if args.random else sweep.grid_combinations(values)
+    session = sweep.load_session(args.folder_path, args.tolerance, args.direction, args.window)
+    table = sweep.sweep(session, combinations, args.workers, args.rank_by)
+    output = args.output or os.path.join(args.folder_path, 'rpi-sweep-' + session['folder'] + '.csv')
+    table.to_csv(output, index=False)
+    print(table.head(args.top).to_string(index=False))
+    print("%d combinations over %d rows, ranked table written to %s" % (len(table), session['rows'], output), file=sys.stderr)
+    return 0
+
+def run_index(args, started):
+    """
+    Function to run the index command.
+    """
+    results = spatial_index.index_sessions(args.log_path, args.index, args.cell_size, args.force, args.only, metrics.options_from_args(args))
+    return finish(args, 'index', results, started)
+
+def run_query(args, started):
+    """
+    Function to run the query command: print the worst cells of the area
+    asked for and optionally write them to a csv file and a heatmap.
+    """
+    connection = spatial_index.open_index(args.index or os.path.join(args.log_path, spatial_index.INDEX_NAME))
+    try:
+        if args.radius:
+            cells = spatial_index.query_radius(connection, *args.radius, sessions=args.session, min_rows=args.min_rows)
+        else:
+            cells = spatial_index.query_box(connection, *(args.box or ()), sessions=args.session, min_rows=args.min_rows)
+    finally:
+        connection.close()
+    cells = spatial_index.sort_cells(cells, args.sort)
+    columns = ['lat', 'lon', 'sessions', 'rows', 'anomaly_rate', 'rpi_drift_mean', 'experimental_drift_mean', 'doppler_drift_mean', 'bearing_mean', 'bearing_std']
+    if args.sort not in columns:
+        columns.append(args.sort)
+    print("  ".join("%12s" % column[:12] for column in columns))
+    for cell in cells[:args.top]:
+        print("  ".join("%12s" % ('-' if cell[column] is None else "%.6f" % cell[column] if column in ('lat', 'lon') else "%.4g" % cell[column]) for column in columns))
+    if args.csv:
+        spatial_index.write_cells_csv(cells, args.csv)
+    if args.heatmap:
+        spatial_index.export_heatmap(cells, args.heatmap, args.sort, args.plotlyjs)
+    print("%d cells in %.3fs" % (len(cells), time.time() - started), file=sys.stderr)
+    return 0
+
+def add_log_path_argument(parser):
+    """
+    Function to add the optional log folder argument to a command's parser.
+    """
+    parser.add_argument('log_path', nargs='?', default=LOG_PATH, help='folder holding the session folders (default: %s)' % LOG_PATH)
+    return parser
+
+def build_parser():
+    """
+    Function to return the parser of every command. Building it imports no
+    pandas, numpy or plotly, so --help and runs with nothing to do start
+    quickly.
+    """
+    parser = argparse.ArgumentParser(prog='sanddance', description='Merge, analyze and plot the sensor logs recorded by the MSRS rpi.')
+    commands = parser.add_subparsers(dest='command', required=True, metavar='COMMAND')
+
+    description = 'Merge the sensor logs of every session folder into a master csv and map.'
+    command = commands.add_parser('format', help=description, description=description)
+    add_log_path_argument(metrics.add_metrics_arguments(report.add_report_arguments(columnar.add_output_format_argument(align.add_alignment_arguments(manifest.add_manifest_arguments(pipeline.add_pipeline_arguments(runner.add_worker_argument(command))))))))
+    command.add_argument('--save-path', default=None, help='folder to write the master tables under (default: the log folder)')
+    command.set_defaults(run=run_format)
+
+    description = 'Calculate the rpi/gps drift of every session folder.'
+    command = commands.add_parser('drift', help=description, description=description)
+    add_log_path_argument(metrics.add_metrics_arguments(report.add_report_arguments(windows.add_window_arguments(columnar.add_output_format_argument(align.add_alignment_arguments(manifest.add_manifest_arguments(pipeline.add_pipeline_arguments(runner.add_worker_argument(command))))), calculate_drift.increment_value))))
+    command.add_argument('--chunk-size', type=int, default=0, help='stream each session in chunks of this many rows to bound memory; writes the analyzed table only (default: 0, load whole sessions)')
+    command.set_defaults(run=run_drift)
+
+    description = 'Redraw the maps and charts of every session folder from its master and analyzed tables.'
+    command = commands.add_parser('plot', help=description, description=description)
+    add_log_path_argument(metrics.add_metrics_arguments(report.add_report_arguments(runner.add_worker_argument(command))))
+    command.add_argument('--only', metavar='FOLDER', help='only plot the session folder with this name')
+    command.set_defaults(run=run_plot)
+
+    description = 'Analyze the drift of a session while it is being recorded.'
+    command = commands.add_parser('follow', help=description, description=description)
+    follow.add_follow_arguments(windows.add_window_arguments(columnar.add_output_format_argument(align.add_alignment_arguments(command)), calculate_drift.increment_value))
+    command.add_argument('folder_path', nargs='?', default=None, help='session folder to follow (default: the newest session under the log folder)')
+    command.add_argument('--log-path', default=LOG_PATH, help='folder the sessions are recorded in (default: %s)' % LOG_PATH)
+    command.set_defaults(run=run_follow)
+
+    description = 'Sweep the drift calculation parameters over one session folder and rank them by drift from the gps track.'
+    command = commands.add_parser('sweep', help=description, description=description)
+    sweep.add_sweep_arguments(align.add_alignment_arguments(runner.add_worker_argument(command)))
+    command.add_argument('folder_path', help='a session folder holding rpi-coordinates.csv, rpi-kvh-compass.csv and rpi-doppler.csv')
+    command.set_defaults(run=run_sweep, error=command.error)
+
+    description = 'Add up the drift and anomalies of every analyzed session into grid cells of a spatial index.'
+    command = commands.add_parser('index', help=description, description=description)
+    add_log_path_argument(metrics.add_metrics_arguments(manifest.add_manifest_arguments(command)))
+    command.add_argument('--index', default=None, help='spatial index file (default: %s in the log folder)' % spatial_index.INDEX_NAME)
+    command.add_argument('--cell-size', type=float, default=spatial_index.CELL_SIZE, help='grid cell edge in degrees, changing it rebuilds the index (default: %s)' % spatial_index.CELL_SIZE)
+    command.set_defaults(run=run_index)
+
+    description = 'Look up the drift and anomalies of the spatial index cells in a bounding box or radius.'
+    command = commands.add_parser('query', help=description, description=description)
+    add_log_path_argument(spatial_index.add_query_arguments(command))
+    command.add_argument('--index', default=None, help='spatial index file (default: %s in the log folder)' % spatial_index.INDEX_NAME)
+    command.add_argument('--plotlyjs', choices=('inline', 'cdn'), default='inline', help='embed plotly.js in the heatmap so it opens offline, or load it from the cdn (default: inline)')
+    command.set_defaults(run=run_query)
+    return parser
+
+def main(argv=None):
+    """
+    Function to run the command given on the command line and return its
+    exit code.
+    """
+    started = time.time()
+    args = build_parser().parse_args(argv)
+    if hasattr(args, 'quiet'):
+        metrics.configure(metrics.options_from_args(args))
+    return args.run(args, started)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import io
+import os
+import csv
+import lazy
+
+pd = lazy.lazy_import('pandas')
+
+# Required columns and dtypes of every sensor log. A dtype of None keeps
+# the type pandas reads, which the timestamp join key relies on so the
+# exact-match join and the master csv keep the logger's values untouched.
+# Every float column is float64: the master and analyzed tables write
+# them back out, and a narrower dtype would change the values written.
+SENSOR_SCHEMAS = {
+    'rpi-coordinates.csv': {'timestamp': None, 'rpi_lat': 'float64', 'rpi_lon': 'float64', 'gps_lat': 'float64', 'gps_lon': 'float64'},
+    'rpi-kvh-compass.csv': {'timestamp': None, 'kvh_heading': 'float64'},
+    'rpi-doppler.csv': {'timestamp': None, 'distance_1': 'float64'},
+    'rpi-altitude-temperature.csv': {'timestamp': None, 'altitude': 'float64'},
+    'rpi-secondary-compass.csv': {'timestamp': None},
+}
+
+# Dtypes of columns that some sessions have and others do not.
+OPTIONAL_DTYPES = {
+    'rpi-coordinates.csv': {'msrs_lat': 'float64', 'msrs_lon': 'float64'},
+    'rpi-altitude-temperature.csv': {'temperature': 'float64'},
+}
+
+
+class SchemaError(ValueError):
+    """
+    Raised when a sensor log is missing a required column or holds a value
+    that does not fit its column's dtype.
+    """
+
+
+def fast_engine():
+    """
+    Function to return the fastest csv parser engine that is installed. The
+    pyarrow engine needs pandas 1.4 or newer as well as pyarrow.
+    """
+    if tuple(int(part) for part in pd.__version__.split('.')[:2]) < (1, 4):
+        return 'c'
+    try:
+        import pyarrow
+        return 'pyarrow'
+    except ImportError:
+        return 'c'
+
+def sensor_dtypes(csv_path, header):
+    """
+    Function to check the header columns of a sensor log against its schema
+    and return the dtypes to read its columns with. Raises SchemaError if a
+    required column is missing.
+    """
+    sensor_file = os.path.basename(csv_path)
+    required = SENSOR_SCHEMAS[sensor_file]
+    missing = [column for column in required if column not in header]
+    if missing:
+        raise SchemaError("%s is missing required columns: %s" % (csv_path, ', '.join(missing)))
+    declared = dict(OPTIONAL_DTYPES.get(sensor_file, {}), **required)
+    return dict((column, dtype) for column, dtype in declared.items() if dtype is not None and column in header)
+
+def read_sensor_csv(csv_path, required_only=False, chunk_size=None):
+    """
+    Function to read a sensor log with the dtypes of its schema. With
+    required_only only the schema's columns are parsed, otherwise every
+    column is kept. Raises SchemaError if the file breaks its schema. With a
+    chunk_size an iterator of chunks is returned instead of one dataframe.
+    """
+    dtypes = sensor_dtypes(csv_path, list(pd.read_csv(csv_path, nrows=0).columns))
+    usecols = list(SENSOR_SCHEMAS[os.path.basename(csv_path)]) if required_only else None
+    engine = fast_engine()
+    # the c engine's default float parser can be one ulp off, round_trip
+    # parses the same values as pyarrow so chunked and whole reads agree
+    options = {'float_precision': 'round_trip'} if chunk_size or engine == 'c' else {}
+    try:
+        if chunk_size:
+            # the pyarrow engine cannot read in chunks
+            return checked_chunks(pd.read_csv(csv_path, usecols=usecols, dtype=dtypes, chunksize=chunk_size, **options), csv_path)
+        return pd.read_csv(csv_path, usecols=usecols, dtype=dtypes, engine=engine, **options)
+    except (ValueError, TypeError) as e:
+        raise SchemaError("%s does not match its schema: %s" % (csv_path, e)) from e
+
+def read_sensor_rows(csv_path, header_line, data, required_only=False):
+    """
+    Function to parse complete lines of a sensor log that were read from
+    csv_path after its header line, with the dtypes of its schema and the
+    same float parsing as a chunked read_sensor_csv. Raises SchemaError if
+    the lines break the schema.
+    """
+    header = next(csv.reader([header_line.decode('utf-8-sig')]))
+    dtypes = sensor_dtypes(csv_path, header)
+    usecols = list(SENSOR_SCHEMAS[os.path.basename(csv_path)]) if required_only else None
+    try:
+        return pd.read_csv(io.BytesIO(header_line + data), usecols=usecols, dtype=dtypes, float_precision='round_trip')
+    except (ValueError, TypeError) as e:
+        raise SchemaError("%s does not match its schema: %s" % (csv_path, e)) from e
+
+def checked_chunks(chunks, csv_path):
+    """
+    Function to pass chunks through, turning a dtype error in a later chunk
+    into a SchemaError naming the file.
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+    except (ValueError, TypeError) as e:
+        raise SchemaError("%s does not match its schema: %s" % (csv_path, e)) from e
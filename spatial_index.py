@@ -0,0 +1,254 @@
+import os
+import csv
+import json
+import math
+import sqlite3
+import geodesy
+import runner
+import manifest
+import columnar
+import metrics
+import report
+import lazy
+
+np = lazy.lazy_import('numpy')
+
+INDEX_NAME = 'spatial-index.sqlite'
+CELL_SIZE = 0.001 # grid cell edge in degrees, about 110 m north to south
+# (aggregate name, analyzed column) of every distance from the gps fix, None
+# for the compass/doppler track, whose distance is worked out here
+DRIFT_METRICS = (('rpi_drift', 'drift_between_rpi_and_gps_meters'), ('experimental_drift', 'drift_from_experimental_coords_to_gps_coords'), ('doppler_drift', None))
+AGGREGATES = ['rows', 'anomaly_rows'] + ['%s_%s' % (name, total) for name, column in DRIFT_METRICS for total in ('count', 'sum', 'squares', 'max')] + ['bearing_count', 'bearing_sin', 'bearing_cos']
+SORT_KEYS = ('anomaly_rate', 'anomaly_rows', 'rows', 'sessions') + tuple('%s_%s' % (name, statistic) for name, column in DRIFT_METRICS for statistic in ('mean', 'max')) + ('bearing_std',)
+CODE_VERSION = manifest.code_version(__file__, geodesy.__file__)
+
+
+def open_index(index_path, cell_size=None):
+    """
+    Function to open the spatial index at index_path, creating it if needed.
+    With a cell_size the index is about to be updated: an index built on a
+    different grid is emptied so it is rebuilt on the new one. Without one
+    the index is only read and must already exist.
+    """
+    if cell_size is None and not os.path.exists(index_path):
+        raise FileNotFoundError("there is no spatial index at %s, build it with 'sanddance index'" % index_path)
+    connection = sqlite3.connect(index_path)
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("CREATE TABLE IF NOT EXISTS sessions (session TEXT PRIMARY KEY, folder TEXT, version TEXT, inputs TEXT, rows INTEGER)")
+        connection.execute("CREATE TABLE IF NOT EXISTS cells (cell_lat INTEGER, cell_lon INTEGER, session TEXT, %s, PRIMARY KEY (cell_lat, cell_lon, session)) WITHOUT ROWID" % ", ".join(name + ' REAL' for name in AGGREGATES))
+        connection.execute("CREATE INDEX IF NOT EXISTS cells_by_session ON cells (session)")
+        stored = connection.execute("SELECT value FROM settings WHERE name = 'cell_size'").fetchone()
+        if cell_size is not None and (stored is None or float(stored[0]) != cell_size):
+            connection.execute("DELETE FROM cells")
+            connection.execute("DELETE FROM sessions")
+            connection.execute("INSERT OR REPLACE INTO settings VALUES ('cell_size', ?)", (repr(float(cell_size)),))
+    return connection
+
+def index_cell_size(connection):
+    """
+    Function to return the grid cell size an index was built with.
+    """
+    stored = connection.execute("SELECT value FROM settings WHERE name = 'cell_size'").fetchone()
+    return float(stored[0]) if stored else CELL_SIZE
+
+def cell_aggregates(df, cell_size=CELL_SIZE):
+    """
+    Function to sum the rows of an analyzed table into the grid cells their
+    gps fix falls in. Returns a dict of arrays, one entry per occupied cell:
+    its grid position, the rows and anomaly rows in it, the count, sum, sum
+    of squares and largest value of every drift metric and the sines and
+    cosines of the gps/rpi bearing difference. Sums rather than means are
+    kept so cells can be added up across sessions exactly.
+    """
+    lat = df['gps_lat'].to_numpy(dtype=np.float64)
+    lon = df['gps_lon'].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(lat) & ~np.isnan(lon)
+    positions = np.stack((np.floor(lat[valid] / cell_size), np.floor(lon[valid] / cell_size)), axis=1).astype(np.int64)
+    keys, inverse = np.unique(positions, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    count = len(keys)
+
+    def total(values):
+        return np.bincount(inverse, weights=values, minlength=count)
+    cells = {'cell_lat': keys[:, 0], 'cell_lon': keys[:, 1], 'rows': np.bincount(inverse, minlength=count)}
+    cells['anomaly_rows'] = total((df['annomaly_gps_lat'].to_numpy(dtype=np.float64) != 0)[valid])
+    for name, column in DRIFT_METRICS:
+        if column is None:
+            values = geodesy.haversine_distances(df['rpi_doppler_compass_lat'].to_numpy(dtype=np.float64), lat, df['rpi_doppler_compass_lon'].to_numpy(dtype=np.float64), lon) * 1000
+        else:
+            values = df[column].to_numpy(dtype=np.float64)
+        values = values[valid]
+        finite = ~np.isnan(values)
+        filled = np.where(finite, values, 0.0)
+        largest = np.full(count, np.nan)
+        np.fmax.at(largest, inverse, values)
+        cells.update({name + '_count': total(finite), name + '_sum': total(filled), name + '_squares': total(filled * filled), name + '_max': largest})
+    bearing = df['gps_minus_rpi_bearing'].to_numpy(dtype=np.float64)[valid]
+    finite = ~np.isnan(bearing)
+    radians = np.radians(np.where(finite, bearing, 0.0))
+    cells.update({'bearing_count': total(finite), 'bearing_sin': total(np.where(finite, np.sin(radians), 0.0)), 'bearing_cos': total(np.where(finite, np.cos(radians), 0.0))})
+    return cells
+
+def index_folder(root, folder, connection, cell_size=CELL_SIZE, force=False):
+    """
+    Function to replace one session's cells in the index with the cells of
+    its analyzed table. Sessions whose analyzed table and the indexing code
+    are unchanged since they were indexed are skipped unless force is set.
+    """
+    frame_path = columnar.find_frame(root + '/' + folder + '/' + 'rpi-coordinates-analyzed-' + folder + '.csv')
+    if frame_path is None:
+        return {'status': 'skipped', 'reason': 'no analyzed table'}
+    session = os.path.join(root, folder)
+    stored = connection.execute("SELECT version, inputs FROM sessions WHERE session = ?", (session,)).fetchone()
+    previous_inputs = json.loads(stored[1]) if stored else {}
+    name = os.path.basename(frame_path)
+    inputs = {name: manifest.fingerprint_file(frame_path, previous_inputs.get(name))}
+    if not force and stored and stored[0] == CODE_VERSION and manifest.same_contents(previous_inputs, inputs):
+        return {'status': 'unchanged', 'reason': 'analyzed table unchanged since it was indexed'}
+    df = metrics.timed('read analyzed', columnar.read_frame, root + '/' + folder + '/' + 'rpi-coordinates-analyzed-' + folder + '.csv')
+    with metrics.stage('aggregate', len(df)):
+        cells = cell_aggregates(df, cell_size)
+    with metrics.stage('index write', len(cells['rows'])):
+        rows = zip(cells['cell_lat'].tolist(), cells['cell_lon'].tolist(), [session] * len(cells['rows']), *[cells[name].tolist() for name in AGGREGATES])
+        with connection:
+            connection.execute("DELETE FROM cells WHERE session = ?", (session,))
+            connection.executemany("INSERT INTO cells VALUES (%s)" % ", ".join('?' * (len(AGGREGATES) + 3)), rows)
+            connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)", (session, folder, CODE_VERSION, json.dumps(inputs, sort_keys=True), len(df)))
+    return {'rows': len(df), 'cells': len(cells['rows'])}
+
+def index_sessions(open_path, index_path=None, cell_size=CELL_SIZE, force=False, only=None, metrics_options=None):
+    """
+    Function to bring the spatial index up to date with the analyzed tables
+    of every session folder under open_path and return the per-folder
+    results. The index is kept in open_path/spatial-index.sqlite unless
+    index_path is given. Sessions whose folder no longer exists are dropped
+    from the index. Folders are indexed one at a time since sqlite takes
+    one writer.
+    """
+    connection = open_index(index_path or os.path.join(open_path, INDEX_NAME), cell_size)
+    try:
+        folders = [(root, folder) for root, folder in runner.list_session_folders(open_path) if only is None or folder == only]
+        results = runner.run_folders(index_folder, folders, (connection, cell_size, force), 1, metrics_options)
+        if only is None:
+            for session, folder in connection.execute("SELECT session, folder FROM sessions").fetchall():
+                if not os.path.isdir(session):
+                    with connection:
+                        connection.execute("DELETE FROM cells WHERE session = ?", (session,))
+                        connection.execute("DELETE FROM sessions WHERE session = ?", (session,))
+                    results.append({'root': os.path.dirname(session), 'folder': folder, 'status': 'removed', 'reason': 'session folder no longer exists', 'seconds': 0.0, 'error': None})
+    finally:
+        connection.close()
+    return results
+
+def cell_summary(row, cell_size):
+    """
+    Function to turn the summed aggregates of one cell into its centre,
+    counts, anomaly rate, the mean, standard deviation and largest value of
+    every drift metric and the circular mean and standard deviation of the
+    bearing difference in degrees.
+    """
+    cell_lat, cell_lon, sessions = row[:3]
+    totals = dict(zip(AGGREGATES, row[3:]))
+    summary = {'lat': (cell_lat + 0.5) * cell_size, 'lon': (cell_lon + 0.5) * cell_size, 'sessions': sessions, 'rows': int(totals['rows']), 'anomaly_rows': int(totals['anomaly_rows'])}
+    summary['anomaly_rate'] = totals['anomaly_rows'] / totals['rows'] if totals['rows'] else None
+    for name, column in DRIFT_METRICS:
+        count = totals[name + '_count']
+        mean = totals[name + '_sum'] / count if count else None
+        summary[name + '_mean'] = mean
+        summary[name + '_std'] = math.sqrt(max(totals[name + '_squares'] / count - mean * mean, 0.0)) if count else None
+        summary[name + '_max'] = totals[name + '_max']
+    count = totals['bearing_count']
+    if count:
+        resultant = min(math.hypot(totals['bearing_sin'], totals['bearing_cos']) / count, 1.0)
+        summary['bearing_mean'] = math.degrees(math.atan2(totals['bearing_sin'], totals['bearing_cos']))
+        summary['bearing_std'] = math.degrees(math.sqrt(max(0.0, -2 * math.log(resultant)))) if resultant > 0 else None
+    else:
+        summary['bearing_mean'] = summary['bearing_std'] = None
+    return summary
+
+def query_box(connection, south=-90.0, west=-180.0, north=90.0, east=180.0, sessions=None, min_rows=1):
+    """
+    Function to return the summary of every cell overlapping a bounding box
+    in degrees, added up over every indexed session or only over the
+    session folder names in sessions. Cells with fewer than min_rows rows
+    are left out. Only the index's cell rows inside the box are read.
+    """
+    if south > north or west > east:
+        raise ValueError("the bounding box must have south <= north and west <= east")
+    cell_size = index_cell_size(connection)
+    where = "cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ?"
+    parameters = [math.floor(south / cell_size), math.floor(north / cell_size), math.floor(west / cell_size), math.floor(east / cell_size)]
+    if sessions:
+        where += " AND session IN (SELECT session FROM sessions WHERE folder IN (%s))" % ", ".join('?' * len(sessions))
+        parameters += list(sessions)
+    totals = ", ".join(('MAX(%s)' if name.endswith('_max') else 'SUM(%s)') % name for name in AGGREGATES)
+    query = "SELECT cell_lat, cell_lon, COUNT(*), %s FROM cells WHERE %s GROUP BY cell_lat, cell_lon HAVING SUM(rows) >= ?" % (totals, where)
+    return [cell_summary(row, cell_size) for row in connection.execute(query, parameters + [min_rows])]
+
+def query_radius(connection, lat, lon, radius, sessions=None, min_rows=1):
+    """
+    Function to return the summary of every cell whose centre is within
+    radius meters of a point, read through the bounding box around the
+    circle, with each cell's distance from the point in meters.
+    """
+    lat_span = math.degrees(radius / (geodesy.EARTH_RADIUS_KM * 1000))
+    lon_span = min(lat_span / max(math.cos(math.radians(lat)), 1e-12), 180.0)
+    cells = []
+    for cell in query_box(connection, max(lat - lat_span, -90.0), max(lon - lon_span, -180.0), min(lat + lat_span, 90.0), min(lon + lon_span, 180.0), sessions, min_rows):
+        cell['distance'] = haversine_meters(lat, lon, cell['lat'], cell['lon'])
+        if cell['distance'] <= radius:
+            cells.append(cell)
+    return cells
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """
+    Function to return the great circle distance between two points in
+    meters on the same sphere as geodesy.haversine_distances.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * geodesy.EARTH_RADIUS_KM * 1000 * math.asin(min(math.sqrt(a), 1.0))
+
+def sort_cells(cells, key='anomaly_rate'):
+    """
+    Function to sort cell summaries worst first by key, cells without a
+    value last.
+    """
+    return sorted(cells, key=lambda cell: (cell[key] is None, -(cell[key] or 0)))
+
+def write_cells_csv(cells, save_path):
+    """
+    Function to write cell summaries to a csv file.
+    """
+    with open(save_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(cells[0].keys()) if cells else ['lat', 'lon'])
+        writer.writeheader()
+        writer.writerows(cells)
+
+def export_heatmap(cells, save_path, value='anomaly_rate', plotlyjs='inline'):
+    """
+    Function to draw cell summaries as a heatmap of value on a mapbox map.
+    """
+    cells = [cell for cell in cells if cell[value] is not None]
+    if not cells:
+        raise ValueError("no cell has a value for %s" % value)
+    lat = [cell['lat'] for cell in cells]
+    lon = [cell['lon'] for cell in cells]
+    layer = report.density_layer(lat, lon, [cell[value] for cell in cells], name=value)
+    return report.map_report([layer], save_path, center={'lat': sum(lat) / len(lat), 'lon': sum(lon) / len(lon)}, zoom=12, plotlyjs=plotlyjs)
+
+def add_query_arguments(parser):
+    """
+    Function to add the spatial query options to an argparse parser.
+    """
+    area = parser.add_mutually_exclusive_group()
+    area.add_argument('--box', nargs=4, type=float, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'), help='cells overlapping this bounding box in degrees')
+    area.add_argument('--radius', nargs=3, type=float, metavar=('LAT', 'LON', 'METERS'), help='cells whose centre is within METERS of LAT LON')
+    parser.add_argument('--session', action='append', metavar='FOLDER', help='only add up these session folders, may be repeated (default: every session)')
+    parser.add_argument('--min-rows', type=int, default=1, help='leave out cells with fewer rows (default: 1)')
+    parser.add_argument('--sort', choices=SORT_KEYS, default='anomaly_rate', help='print the cells worst first by this value (default: anomaly_rate)')
+    parser.add_argument('--top', type=int, default=20, help='cells to print (default: 20)')
+    parser.add_argument('--csv', metavar='FILE', help='write every matching cell to a csv file')
+    parser.add_argument('--heatmap', metavar='FILE', help='draw the matching cells as a heatmap of the --sort value in an html map')
+    return parser
@@ -0,0 +1,166 @@
+import os
+import sys
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import lazy
+import geodesy
+import dead_reckoning
+import windows
+import align
+import calculate_drift
+
+np = lazy.lazy_import('numpy')
+pd = lazy.lazy_import('pandas')
+
+PARAMETERS = ('doppler_compensation_factor', 'compass_vehicle_alignment_error', 'increment_value', 'drift_threshold')
+SCORES = ('final_drift', 'mean_drift', 'doppler_final_drift', 'doppler_mean_drift')
+RANK_BY = ('mean', 'final')
+
+# the session a worker evaluates combinations against, set once per process
+_session = None
+
+
+def load_session(folder_path, tolerance=0, direction='nearest', window_mode='block'):
+    """
+    Function to read and align the sensor files of one session folder and
+    return the arrays every parameter combination is scored on. Nothing in
+    here depends on the swept parameters, so it is done once per sweep.
+    window_mode is the drift window every combination is averaged over.
+    """
+    root, folder = os.path.split(os.path.normpath(folder_path))
+    coordinates, match_rates = align.align_streams(calculate_drift.read_sensor_files(root, folder), on='timestamp', tolerance=tolerance, direction=direction)
+    if len(coordinates) == 0:
+        raise ValueError('no aligned rows in ' + folder_path)
+    calculate_drift.add_track_columns(coordinates)
+    session = {'folder': folder, 'rows': len(coordinates), 'match_rates': match_rates, 'window_mode': window_mode}
+    for column in ['gps_lat', 'gps_lon', 'rpi_bearing', 'rpi_distance_from_prev_coord_meters', 'rpi_heading', 'rpi_doppler_distance', 'gps_minus_rpi_bearing']:
+        session[column] = coordinates[column].to_numpy(dtype=np.float64)
+    return session
+
+def set_session(session):
+    """
+    Function to install the session the worker process evaluates against,
+    with the prefix sums of its bearing difference, room for the average
+    drift of each window size and reusable dead-reckoning output arrays.
+    """
+    global _session
+    _session = dict(session, prefix=windows.prefix_sums(session['gps_minus_rpi_bearing']), average_drift={}, out_lat=np.empty(session['rows']), out_lon=np.empty(session['rows']))
+
+def evaluate(parameters):
+    """
+    Function to replay the experimental and compass/doppler tracks of the
+    loaded session with one combination of parameters and return it with its
+    scores: the final and mean distance in meters of each track from the gps
+    track.
+    """
+    session = _session
+    increment_value = int(parameters['increment_value'])
+    if increment_value not in session['average_drift']:
+        starts, ends = windows.window_bounds(0, session['rows'], session['rows'], increment_value, session['window_mode'])
+        session['average_drift'][increment_value] = windows.window_statistics(session['prefix'], starts, ends)[0]
+    average_drift_array = session['average_drift'][increment_value]
+    gps_lat = session['gps_lat']
+    gps_lon = session['gps_lon']
+
+    rpi_bearing = session['rpi_bearing']
+    headings, experimental_heading, corrected = calculate_drift.experimental_headings(rpi_bearing, average_drift_array, rpi_bearing[0], parameters['compass_vehicle_alignment_error'], parameters['drift_threshold'])
+    steps = dead_reckoning.prepare_steps(headings, session['rpi_distance_from_prev_coord_meters'])
+    experimental_lat, experimental_lon = dead_reckoning.integrate_steps(gps_lat[0], gps_lon[0], steps, session['out_lat'], session['out_lon'])
+    drift = geodesy.haversine_distances(experimental_lat, gps_lat, experimental_lon, gps_lon) * 1000
+
+    steps = dead_reckoning.prepare_steps(session['rpi_heading'], session['rpi_doppler_distance'] * parameters['doppler_compensation_factor'])
+    doppler_lat, doppler_lon = dead_reckoning.integrate_steps(gps_lat[0], gps_lon[0], steps, session['out_lat'], session['out_lon'])
+    doppler_drift = geodesy.haversine_distances(doppler_lat, gps_lat, doppler_lon, gps_lon) * 1000
+
+    scores = {'final_drift': drift[-1], 'mean_drift': drift.mean(), 'doppler_final_drift': doppler_drift[-1], 'doppler_mean_drift': doppler_drift.mean(), 'anomaly_rows': int(len(corrected) - corrected.sum())}
+    return dict(parameters, **scores)
+
+def grid_combinations(values):
+    """
+    Function to return every combination of the values listed for each
+    parameter.
+    """
+    return [dict(zip(PARAMETERS, combination)) for combination in itertools.product(*[values[name] for name in PARAMETERS])]
+
+def random_combinations(values, count, seed=None):
+    """
+    Function to return count combinations drawn uniformly between the
+    smallest and largest value listed for each parameter. Window sizes are
+    drawn as whole rows.
+    """
+    rng = np.random.default_rng(seed)
+    combinations = []
+    for _ in range(count):
+        combination = {}
+        for name in PARAMETERS:
+            low, high = min(values[name]), max(values[name])
+            if name == 'increment_value':
+                combination[name] = int(rng.integers(low, high + 1))
+            else:
+                combination[name] = float(rng.uniform(low, high)) if high > low else low
+        combinations.append(combination)
+    return combinations
+
+def rank_results(results, rank_by='mean'):
+    """
+    Function to return the results as a table sorted best first by the
+    experimental track's mean or final drift, then the other, then the
+    compass/doppler track's drift.
+    """
+    order = ['mean_drift', 'final_drift'] if rank_by == 'mean' else ['final_drift', 'mean_drift']
+    table = pd.DataFrame(results, columns=list(PARAMETERS) + list(SCORES) + ['anomaly_rows'])
+    table = table.sort_values(order + ['doppler_mean_drift', 'doppler_final_drift'], kind='stable').reset_index(drop=True)
+    table.insert(0, 'rank', np.arange(1, len(table) + 1))
+    return table
+
+def sweep(session, combinations, workers=1, rank_by='mean'):
+    """
+    Function to score every parameter combination against a loaded session,
+    in parallel on a process pool when workers > 1, and return the ranked
+    table. The session is sent to each worker once, not once per combination.
+    """
+    if workers <= 1 or len(combinations) <= 1:
+        set_session(session)
+        results = [evaluate(combination) for combination in combinations]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_session, initargs=(session,)) as executor:
+            results = list(executor.map(evaluate, combinations, chunksize=max(1, len(combinations) // (workers * 4))))
+    return rank_results(results, rank_by)
+
+def parse_values(text):
+    """
+    Function to parse a parameter's values given as a comma separated list
+    (1.0,1.019) or a start:stop:step range that includes stop (1.0:1.04:0.01).
+    """
+    try:
+        if ':' in text:
+            start, stop, step = [float(value) for value in text.split(':')]
+            if step <= 0:
+                raise ValueError
+            return [float(value) for value in np.round(np.arange(start, stop + step / 2, step), 12)]
+        return [float(value) for value in text.split(',') if value.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r is not a comma separated list or a start:stop:step range" % text)
+
+def add_sweep_arguments(parser):
+    """
+    Function to add one option per swept parameter to an argparse parser,
+    each defaulting to the value calculate_drift uses.
+    """
+    parser.add_argument('--doppler-factor', type=parse_values, default=[calculate_drift.doppler_compensation_factor], help='doppler_compensation_factor values (default: %s)' % calculate_drift.doppler_compensation_factor)
+    parser.add_argument('--alignment-error', type=parse_values, default=[calculate_drift.compass_vehicle_alignment_error], help='compass_vehicle_alignment_error values in degrees, write negative values as --alignment-error=-3:3:1 (default: %s)' % calculate_drift.compass_vehicle_alignment_error)
+    parser.add_argument('--increment', type=parse_values, default=[calculate_drift.increment_value], help='drift window sizes in rows (default: %s)' % calculate_drift.increment_value)
+    parser.add_argument('--threshold', type=parse_values, default=[calculate_drift.drift_threshold], help='largest average drift in degrees that is still corrected (default: %s)' % calculate_drift.drift_threshold)
+    parser.add_argument('--window', choices=windows.WINDOW_MODES, default='block', help='average the bearing difference over the next block of rows or a rolling window centred on each row (default: block)')
+    parser.add_argument('--random', type=int, default=0, metavar='COUNT', help='draw COUNT random combinations between each parameter\'s smallest and largest value instead of the full grid')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for --random')
+    parser.add_argument('--rank-by', choices=RANK_BY, default='mean', help='rank by the mean or the final drift from the gps track (default: mean)')
+    parser.add_argument('--top', type=int, default=20, help='rows of the ranked table to print (default: 20)')
+    parser.add_argument('--output', default=None, help='csv file for the full ranked table (default: rpi-sweep-{folder}.csv in the session folder)')
+    return parser
+
+
+if __name__ == '__main__':
+    import sanddance
+    sys.exit(sanddance.main(['sweep'] + sys.argv[1:]))
@@ -7,4 +7,193 @@ def get_turf_distance(lat1, lat2, lon1, lon2):
   dist = measurement.distance(start,end)
   return dist
 
-print(get_turf_distance(38.8027247, 38.7997920649094, -77.0707354, -77.074063879149)*1000)
\ No newline at end of file
+print(get_turf_distance(38.8027247, 38.7997920649094, -77.0707354, -77.074063879149)*1000)
+
+# Parity check between the scalar helpers in calculate_drift and the vectorized
+# geodesy kernel.
+import numpy as np
+from geopy.distance import geodesic
+import geodesy
+from calculate_drift import calculate_compass_bearing
+
+rng = np.random.default_rng(0)
+lats = 38.8 + np.cumsum(rng.normal(0, 1e-5, 500))
+lons = -77.07 + np.cumsum(rng.normal(0, 1e-5, 500))
+lats[100:110] = lats[99] # stationary stretch exercises the zero-bearing carry forward
+lons[100:110] = lons[99]
+other_lats = lats + rng.normal(0, 5e-5, 500)
+other_lons = lons + rng.normal(0, 5e-5, 500)
+
+prev_lat, prev_lon, prev_bearing = lats[0], lons[0], 0
+scalar_bearings, scalar_distances, scalar_drift = [], [], []
+for lat, lon, other_lat, other_lon in zip(lats, lons, other_lats, other_lons):
+  bearing = calculate_compass_bearing(prev_lat, lat, prev_lon, lon)
+  if bearing >= 180 and bearing <= 181 or bearing >= 270 and bearing <= 271 or bearing == 0:
+    bearing = prev_bearing
+  scalar_bearings.append(bearing)
+  scalar_distances.append(get_turf_distance(prev_lat, lat, prev_lon, lon))
+  scalar_drift.append(geodesic((lat, lon), (other_lat, other_lon)).km * 1000)
+  prev_lat, prev_lon, prev_bearing = lat, lon, bearing
+
+assert np.allclose(geodesy.track_bearings(lats, lons), scalar_bearings, rtol=0, atol=1e-9)
+assert np.allclose(geodesy.track_distances(lats, lons), scalar_distances, rtol=0, atol=1e-12)
+assert np.allclose(geodesy.geodesic_distances(lats, lons, other_lats, other_lons), scalar_drift, rtol=0, atol=1e-6)
+print('geodesy parity ok')
+
+# Parity check between calculate_new_coordinates and the dead-reckoning engine.
+import dead_reckoning
+from calculate_drift import calculate_new_coordinates
+
+headings = rng.uniform(0, 360, 500)
+distances = rng.uniform(0, 3, 500)
+new_lat, new_lon = lats[0], lons[0]
+scalar_lats, scalar_lons = [], []
+for heading, distance in zip(headings, distances):
+  new_position = calculate_new_coordinates(new_lat, new_lon, heading, distance)
+  new_lat, new_lon = new_position['lat'], new_position['lon']
+  scalar_lats.append(new_lat)
+  scalar_lons.append(new_lon)
+
+steps = dead_reckoning.prepare_steps(headings, distances)
+# numba is optional, its engine is only checked when it is installed
+for engine in ('python', 'numba') if dead_reckoning._compile() is not None else ('python',):
+  engine_lats, engine_lons = dead_reckoning.integrate_steps(lats[0], lons[0], steps, engine=engine)
+  assert np.allclose(engine_lats, scalar_lats, rtol=0, atol=1e-12)
+  assert np.allclose(engine_lons, scalar_lons, rtol=0, atol=1e-12)
+print('dead reckoning parity ok')
+
+# Circular drift windows average headings either side of north to north.
+import windows
+
+wrapped_mean, wrapped_deviation = windows.drift_statistics(np.array([359.0, 1.0, 358.0, 2.0]), 4, 'rolling')
+assert np.allclose(wrapped_mean, 0, atol=1e-9)
+assert np.all(wrapped_deviation < 2)
+print('circular drift windows ok')
+
+# Parity check between the timestamp join and pd.merge_asof, and between the
+# chunked and whole-file joins.
+import pandas as pd
+import align
+
+base_keys = np.sort(rng.integers(0, 5000, 800))
+keys = np.sort(rng.integers(0, 5000, 600))
+keys[200:205] = keys[199] # repeated timestamps
+for direction in align.DIRECTIONS:
+  for tolerance in (0, 1, 7, 40, 10000):
+    positions, matched = align.match_rows(base_keys, keys, tolerance, direction)
+    expected = pd.merge_asof(pd.DataFrame({'timestamp': base_keys}), pd.DataFrame({'timestamp': keys, 'row': np.arange(len(keys))}), on='timestamp', direction=direction, tolerance=tolerance)['row']
+    assert np.array_equal(matched, expected.notna().to_numpy())
+    # repeated timestamps may match any of their rows, so compare the timestamps matched
+    assert np.array_equal(keys[positions[matched]], keys[expected[matched].astype(int).to_numpy()])
+
+def chunked(frame, size):
+  return [frame.iloc[start:start + size] for start in range(0, len(frame), size)]
+
+streams = [('base', pd.DataFrame({'timestamp': base_keys, 'value': rng.normal(size=len(base_keys))})),
+           ('other', pd.DataFrame({'timestamp': keys, 'value': rng.normal(size=len(keys))})),
+           ('sparse', pd.DataFrame({'timestamp': keys[::3], 'reading': rng.normal(size=len(keys[::3]))}))]
+for direction in align.DIRECTIONS:
+  for tolerance in (0, 7, 40):
+    whole, whole_rates = align.align_streams(streams, tolerance=tolerance, direction=direction)
+    for size in (1, 37, 1000):
+      rates = {}
+      pieces = list(align.align_chunks([(name, iter(chunked(frame, size))) for name, frame in streams], tolerance=tolerance, direction=direction, match_rates=rates))
+      pd.testing.assert_frame_equal(pd.concat(pieces, ignore_index=True), whole)
+      assert all(abs(rates[name] - whole_rates[name]) < 1e-12 for name in whole_rates)
+print('timestamp join parity ok')
+
+# Parity check between the chunked and the in-memory drift of a session. The
+# csv must be byte for byte the same; the chunked parquet and feather files
+# hold one row group or batch per chunk, so their tables are compared.
+import os
+import tempfile
+import benchmark
+import calculate_drift
+
+try:
+  import pyarrow
+  columnar_formats = ('parquet', 'feather') # pyarrow is optional, the columnar copies are only checked with it
+except ImportError:
+  columnar_formats = ()
+read_columnar = {'parquet': pd.read_parquet, 'feather': pd.read_feather}
+
+with tempfile.TemporaryDirectory() as directory:
+  folder = 'session'
+  benchmark.make_session(os.path.join(directory, folder), 1500, clock_skew=5, seed=1)
+  formats = ('csv',) + columnar_formats
+  csv_path = os.path.join(directory, folder, 'rpi-coordinates-analyzed-' + folder + '.csv')
+  for window_mode in windows.WINDOW_MODES:
+    calculate_drift.calculate_drift_for_folder(directory, folder, 5, 'nearest', formats, window_mode, calculate_drift.increment_value)
+    with open(csv_path, 'rb') as f:
+      in_memory_csv = f.read()
+    in_memory = [read_columnar[file_format](csv_path.replace('.csv', '.' + file_format)) for file_format in columnar_formats]
+    for file_format in formats:
+      os.remove(csv_path.replace('.csv', '.' + file_format))
+    calculate_drift.calculate_drift_for_folder_in_chunks(directory, folder, 5, 'nearest', formats, 97, window_mode, calculate_drift.increment_value)
+    with open(csv_path, 'rb') as f:
+      assert f.read() == in_memory_csv
+    for file_format, expected in zip(columnar_formats, in_memory):
+      pd.testing.assert_frame_equal(read_columnar[file_format](csv_path.replace('.csv', '.' + file_format)), expected)
+print('chunked drift parity ok')
+
+# The manifest skips a folder only while its inputs, code and outputs are
+# unchanged, and --force and --only override it.
+import time
+
+def statuses(results):
+  return dict((result['folder'], result['status']) for result in results)
+
+with tempfile.TemporaryDirectory() as directory:
+  first, second = [os.path.basename(path) for path in benchmark.make_sessions(directory, 2, 1000, clock_skew=5)]
+  def drift(force=False, only=None):
+    return statuses(calculate_drift.calculate_drift(directory, directory, 1, force, only, 5, metrics_options={'quiet': True}))
+  assert drift() == {first: 'ok', second: 'ok'}
+  assert drift() == {first: 'unchanged', second: 'unchanged'}
+  doppler_path = os.path.join(directory, first, 'rpi-doppler.csv')
+  later = time.time() + 10
+  os.utime(doppler_path, (later, later)) # touched, same contents
+  assert drift() == {first: 'unchanged', second: 'unchanged'}
+  benchmark.make_session(os.path.join(directory, first), 1000, clock_skew=5, seed=7) # new contents
+  assert drift() == {first: 'ok', second: 'unchanged'}
+  os.remove(os.path.join(directory, second, 'rpi-map-' + second + '.html'))
+  assert drift() == {first: 'unchanged', second: 'ok'}
+  assert drift(force=True) == {first: 'ok', second: 'ok'}
+  assert drift(only=second) == {second: 'unchanged'}
+  assert drift(force=True, only=second) == {second: 'ok'}
+print('manifest skipping ok')
+
+# Parity check between the spatial index queries and a groupby of the
+# analyzed tables the index was built from.
+import math
+import spatial_index
+
+with tempfile.TemporaryDirectory() as directory:
+  benchmark.make_sessions(directory, 2, 3000)
+  calculate_drift.calculate_drift(directory, directory, metrics_options={'quiet': True})
+  spatial_index.index_sessions(directory, metrics_options={'quiet': True})
+  analyzed = pd.concat([pd.read_csv(os.path.join(directory, folder, 'rpi-coordinates-analyzed-' + folder + '.csv')).assign(session=folder) for folder in sorted(os.listdir(directory)) if os.path.isdir(os.path.join(directory, folder))], ignore_index=True)
+  analyzed['cell_lat'] = np.floor(analyzed['gps_lat'] / spatial_index.CELL_SIZE).astype(int)
+  analyzed['cell_lon'] = np.floor(analyzed['gps_lon'] / spatial_index.CELL_SIZE).astype(int)
+  analyzed['anomaly'] = analyzed['annomaly_gps_lat'] != 0
+  grouped = analyzed.groupby(['cell_lat', 'cell_lon'])
+  expected = pd.DataFrame({'rows': grouped.size(), 'sessions': grouped['session'].nunique(), 'anomaly_rate': grouped['anomaly'].mean(),
+                           'rpi_drift_mean': grouped['drift_between_rpi_and_gps_meters'].mean(), 'rpi_drift_std': grouped['drift_between_rpi_and_gps_meters'].std(ddof=0),
+                           'experimental_drift_mean': grouped['drift_from_experimental_coords_to_gps_coords'].mean(), 'experimental_drift_std': grouped['drift_from_experimental_coords_to_gps_coords'].std(ddof=0)})
+  connection = spatial_index.open_index(os.path.join(directory, spatial_index.INDEX_NAME))
+  cells = spatial_index.query_box(connection)
+  assert expected['sessions'].max() == 2 # the sessions share cells, so cross-session sums are checked
+  assert len(cells) == len(expected)
+  for cell in cells:
+    row = expected.loc[(int(math.floor(cell['lat'] / spatial_index.CELL_SIZE)), int(math.floor(cell['lon'] / spatial_index.CELL_SIZE)))]
+    assert cell['rows'] == row['rows'] and cell['sessions'] == row['sessions']
+    for column in ('anomaly_rate', 'rpi_drift_mean', 'rpi_drift_std', 'experimental_drift_mean', 'experimental_drift_std'):
+      assert abs(cell[column] - row[column]) < 1e-6, column
+
+  busiest = max(cells, key=lambda cell: cell['rows'])
+  lat, lon, radius = busiest['lat'], busiest['lon'] + 0.3 * spatial_index.CELL_SIZE, 250.0
+  near = spatial_index.query_radius(connection, lat, lon, radius)
+  distances = geodesy.haversine_distances(np.full(len(cells), lat), np.array([cell['lat'] for cell in cells]), np.full(len(cells), lon), np.array([cell['lon'] for cell in cells]), precision=None) * 1000
+  assert 0 < len(near) < len(cells)
+  assert sorted((cell['lat'], cell['lon']) for cell in near) == sorted((cell['lat'], cell['lon']) for cell, distance in zip(cells, distances) if distance <= radius)
+  connection.close()
+print('spatial index parity ok')
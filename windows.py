@@ -0,0 +1,108 @@
+import lazy
+
+np = lazy.lazy_import('numpy')
+
+WINDOW_MODES = ('block', 'rolling')
+
+
+def window_bounds(first_row, row_count, total_rows, size, mode='block'):
+    """
+    Function to return the (start, end) rows of the window averaged for each
+    of row_count rows starting at first_row. 'block' gives every row of a
+    block of size rows the block after it, clamped to the last block of the
+    session. 'rolling' gives every row the size rows centred on it, shifted
+    to stay inside the session. Ends never decrease from one row to the next.
+    """
+    if mode not in WINDOW_MODES:
+        raise ValueError("window mode must be one of %s, not %r" % (WINDOW_MODES, mode))
+    if size < 1:
+        raise ValueError("window size must be at least 1 row, not %r" % size)
+    rows = np.arange(first_row, first_row + row_count)
+    if mode == 'block':
+        block = rows // size
+        starts = size * np.minimum(block + 1, (total_rows - 1) // size)
+        ends = np.minimum(size * (block + 2), total_rows)
+    else:
+        starts = np.clip(rows - size // 2, 0, max(total_rows - size, 0))
+        ends = np.minimum(starts + size, total_rows)
+    return starts, ends
+
+def prefix_sums(values, circular=True, start=None):
+    """
+    Function to return the running totals window_statistics needs, each one
+    element longer than values. Angles in degrees are summed as sines and
+    cosines when circular, otherwise the values and their squares are
+    summed. NaNs are left out. start is the prefix sums of the rows before
+    values; the totals carry on from them exactly as if both had been summed
+    in one go.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    if circular:
+        radians = np.radians(filled)
+        columns = {'count': valid.astype(np.int64), 'sin': np.where(valid, np.sin(radians), 0.0), 'cos': np.where(valid, np.cos(radians), 0.0)}
+    else:
+        columns = {'count': valid.astype(np.int64), 'sum': filled, 'squares': filled * filled}
+    prefix = {}
+    for name, column in columns.items():
+        initial = column.dtype.type(0) if start is None else start[name][-1]
+        prefix[name] = np.cumsum(np.concatenate(([initial], column)))
+    return prefix
+
+def append_prefix_sums(prefix, values, circular=True):
+    """
+    Function to extend prefix sums with the totals of more rows.
+    """
+    more = prefix_sums(values, circular, prefix)
+    return dict((name, np.concatenate((column, more[name][1:]))) for name, column in prefix.items())
+
+def drop_prefix_rows(prefix, rows):
+    """
+    Function to forget the prefix sums of the first rows, once no window
+    starts before them any more.
+    """
+    return dict((name, column[rows:]) for name, column in prefix.items())
+
+def window_statistics(prefix, starts, ends, circular=True):
+    """
+    Function to return the mean and standard deviation of every window from
+    prefix sums in O(1) per window. starts and ends are positions in the
+    prefix sums. Circular means are in degrees between -180 and 180, so
+    angles either side of 0/360 average to a heading between them, and the
+    circular standard deviation is sqrt(-2 ln R) in degrees. Windows with no
+    values are NaN.
+    """
+    count = prefix['count'][ends] - prefix['count'][starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if circular:
+            sin_mean = (prefix['sin'][ends] - prefix['sin'][starts]) / count
+            cos_mean = (prefix['cos'][ends] - prefix['cos'][starts]) / count
+            mean = np.degrees(np.arctan2(sin_mean, cos_mean))
+            resultant = np.minimum(np.hypot(sin_mean, cos_mean), 1.0)
+            deviation = np.degrees(np.sqrt(-2 * np.log(resultant)))
+        else:
+            mean = (prefix['sum'][ends] - prefix['sum'][starts]) / count
+            squares = (prefix['squares'][ends] - prefix['squares'][starts]) / count
+            deviation = np.sqrt(np.maximum(squares - mean * mean, 0.0))
+    # a single value has no spread, whatever rounding the sums picked up
+    deviation = np.where(count == 1, 0.0, deviation)
+    empty = count == 0
+    return np.where(empty, np.nan, mean), np.where(empty, np.nan, deviation)
+
+def drift_statistics(values, size, mode='block', circular=True):
+    """
+    Function to return the window mean and standard deviation of every row
+    of a whole session's values in O(n).
+    """
+    starts, ends = window_bounds(0, len(values), len(values), size, mode)
+    return window_statistics(prefix_sums(values, circular), starts, ends, circular)
+
+def add_window_arguments(parser, default_size=10):
+    """
+    Function to add the shared --window and --window-size options to an
+    argparse parser.
+    """
+    parser.add_argument('--window', choices=WINDOW_MODES, default='block', help='average the bearing difference over the next block of rows or a rolling window centred on each row (default: block)')
+    parser.add_argument('--window-size', type=int, default=default_size, help='rows in each drift window (default: %d)' % default_size)
+    return parser